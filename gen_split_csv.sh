@@ -25,30 +25,16 @@ echo "Destination folder", $dest_folder
 echo ""
 echo "Splitting file" $fname
 
-# Generate split csv
-./velox/_build/release/velox/examples/split_csv $fname
+# Generate split csv straight into the destination folder
+rm -f $dest_folder/fact.csv $dest_folder/dim*.csv $dest_folder/schema.json $dest_folder/grouping.json
+./velox/_build/release/velox/examples/split_csv --output_dir=$dest_folder $fname
 
-split_generated=0
-for f in $(find ./* -maxdepth 1 -name "fact.csv")
-do
-    split_generated=1
-done
-if [ $split_generated -eq 0 ]
+if [ ! -f $dest_folder/fact.csv ]
 then
     cp ${fname} ${dest_folder}/fact.csv
     exit 0
 fi
 
-# Load into pandas and overwrite to remove quotes
-for f in $(find . -name "dim*")
-do
-	python3 scripts/remove_quotes.py ${f}
-done
-python3 scripts/remove_quotes.py fact.csv
-
-mv dim* $dest_folder
-mv fact.csv $dest_folder
-
 echo ""
 echo "Split CSV stored in folder" $dest_folder
 
@@ -33,15 +33,11 @@ do
     foldername="$dest_folder/$foldername"
     mkdir -p $foldername
 
-    # Generate split csv
-    ./velox/_build/release/velox/examples/split_csv $csv
+    # Generate split csv straight into the destination folder
+    rm -f "$foldername"/fact.csv "$foldername"/dim*.csv "$foldername"/schema.json "$foldername"/grouping.json
+    ./velox/_build/release/velox/examples/split_csv --output_dir="$foldername" "$csv"
 
-    split_generated=0
-    for f in $(find ./* -maxdepth 1 -name "fact.csv")
-    do
-        split_generated=1
-    done
-    if [ $split_generated -eq 0 ]
+    if [ ! -f "$foldername/fact.csv" ]
     then
         cp ${csv} ${foldername}/fact.csv
         csv_size=$(find ${csv} -printf "%s")
@@ -49,22 +45,16 @@ do
         continue
     fi
 
-    # Load into pandas and overwrite to remove quotes
     n=0
-    for f in $(find ./* -maxdepth 1 -name "dim*")
+    for f in $(find "$foldername" -maxdepth 1 -name "dim*")
     do
-        python3 scripts/remove_quotes.py ${f}
         n=$(expr $n + 1)
         csv_size=$(find $f -printf "%s")
         split_size=$(expr $csv_size + $split_size)
     done
-    python3 scripts/remove_quotes.py fact.csv
-    csv_size=$(find "fact.csv" -printf "%s")
+    csv_size=$(find "$foldername/fact.csv" -printf "%s")
     split_size=$(expr $csv_size + $split_size)
 
-    mv dim* $foldername
-    mv fact.csv $foldername
-
     echo "Generated $n dimension tables"
 done
 
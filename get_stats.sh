@@ -38,14 +38,9 @@ do
 
         # Generate split csv
         start=`date +%s%N`
-        ./velox/_build/release/velox/examples/split_csv $csv
+        ./velox/_build/release/velox/examples/split_csv --output_dir="$foldername" "$csv"
 
-        split_generated=0
-        for f in $(find . -maxdepth 1 -name "fact.csv")
-        do
-            split_generated=1
-        done
-        if [ $split_generated -eq 0 ]
+        if [ ! -f "$foldername/fact.csv" ]
         then
             cp ${csv} ${foldername}/fact.csv
             csv_size=$(find ${csv} -printf "%s")
@@ -53,20 +48,15 @@ do
             continue
         fi
 
-        # Load into pandas and overwrite to remove quotes
         n=0
-        for f in $(find . -maxdepth 1 -name "dim*")
+        for f in $(find "$foldername" -maxdepth 1 -name "dim*")
         do
-            python3 scripts/remove_quotes.py ${f}
             n=$(expr $n + 1)
             csv_size=$(find $f -printf "%s")
             split_size=$(expr $csv_size + $split_size)
-            mv $f $foldername
         done
-        python3 scripts/remove_quotes.py fact.csv
-        csv_size=$(find . -maxdepth 1 -name "fact.csv" -printf "%s")
+        csv_size=$(find "$foldername" -maxdepth 1 -name "fact.csv" -printf "%s")
         split_size=$(expr $csv_size + $split_size)
-        mv fact.csv $foldername
 
         end=`date +%s%N`
 
@@ -109,65 +99,15 @@ do
 	echo "Split zip creation time: `expr $end - $start` nanoseconds."
 	echo ""
 
-	echo "PyArrow (python3) CSV loading bechmark"
-	echo "Load original dataset into PyArrow (repeated five times)"
-	for i in {1..5}
-	do
-		echo $i
-		/usr/bin/time -o output.txt -v python3 scripts/pyarrow_benchmark.py data/
-		cat output.txt | grep "Maximum"
-	done
-
-	echo "Load split dataset into PyArrow (repeated five times)"
-	for i in {1..5}
-	do
-		echo $i
-		/usr/bin/time -o output.txt -v python3 scripts/pyarrow_benchmark.py split_dataset/
-		cat output.txt | grep "Maximum"
-	done
-	echo ""
-
-	echo "pandas (python3) CSV loading bechmark"
-	echo "Load original dataset into pandas (repeated five times)"
-	for i in {1..5}
-	do
-		echo $i
-		/usr/bin/time -o output.txt -v python3 scripts/pandas_loading_benchmark.py data/
-		cat output.txt | grep "Maximum"
-	done
-
-	echo "Load split dataset into pandas (repeated five times)"
-	for i in {1..5}
-	do
-		echo $i
-		/usr/bin/time -o output.txt -v python3 scripts/pandas_loading_benchmark.py split_dataset/
-		cat output.txt | grep "Maximum"
-	done
-	echo ""
-
-	echo "DuckDB (python3) CSV loading bechmark"
-	echo "Load original dataset into DuckDB (repeated five times)"
-	for i in {1..5}
-	do
-		echo $i
-		/usr/bin/time -o output.txt -v python3 scripts/duckdb_loading_benchmark.py data/
-		cat output.txt | grep "Maximum"
-	done
-
-	echo "Load split dataset into DuckDB (repeated five times)"
-	for i in {1..5}
-	do
-		echo $i
-		/usr/bin/time -o output.txt -v python3 scripts/duckdb_loading_benchmark.py split_dataset/
-		cat output.txt | grep "Maximum"
-	done
+	echo "CSV loading benchmark of the original and split datasets (PyArrow, pandas, DuckDB)"
+	python3 -m splitting.benchmark data/ split_dataset/ --engines pyarrow,pandas,duckdb --warmup 0 --repeat 5 \
+		--output "loading_benchmark_$(basename "$zip" .zip).json"
 	echo ""
  
 	rm -r data
 	rm -r split_dataset
 	rm data.zip
 	rm split_dataset.zip
-	rm output.txt
 	echo ""
 	echo ""
 done
@@ -5,6 +5,8 @@
 # 
 # To switch between the default and split CSV format, use `init_ddb_from_csv` and `init_ddb_from_split_csv` respectively.
 # 
+# Both come from `splitting/loader.py`. `init_ddb_from_split_csv(..., mode="lazy")` (or `mode="hybrid"`) creates views over the split files instead of copying them (or only copies the fact table).
+# 
 # The code for printing has been commented out. Uncomment to debug.
 # 
 # Note that the CSV file used in the original notebook appears to be slightly different from the presently downloaded CSV file, so the output is slightly different. I have cross-checked the output by running the code from the original notebook on this dataset.
@@ -12,94 +14,14 @@
 # In[1]:
 
 
+import os
+import sys
 import time
 
-def init_ddb_from_csv(db_filename, tablename, csv_filename, **kwargs):
-    """
-    Load from the csv file into a DuckDB database.
-    
-    db_filename: Name of the database
-    tablename: Table to load to
-    csv_filename: CSV file to load from
-    **kwargs: Options for DuckDB's read_csv function, see https://duckdb.org/docs/data/csv/overview
-    """
-    import duckdb
-    duckdb_con = duckdb.connect(db_filename)
-    read_csv_args_list = ["'{}'".format(csv_filename)]
-    schema = {tablename : {
-        "fact" : tablename + "_fact",
-        "dimension_tables" : {},
-        "col_to_table_map" : {}
-    }}
-    for key, value in kwargs.items():
-        read_csv_args_list.append("{0} = {1}".format(key, value))
-    read_csv_args = ','.join(read_csv_args_list)
-    sql_stmt = "CREATE TABLE {} AS SELECT * FROM read_csv({}, AUTO_DETECT=TRUE)".format(tablename, read_csv_args)
-    print(sql_stmt)
-    duckdb_con.sql(sql_stmt)
-    table = duckdb_con.table(tablename)
-    for col in table.columns:
-        schema[tablename]["col_to_table_map"][col] = schema[tablename]["fact"]
-    duckdb_con.close()
-    return schema
-
-def init_ddb_from_split_csv(db_filename, tablename, split_csv_foldername, **kwargs):
-    """
-    Load the split csv file into a DuckDB database and expose a view with tablename
-
-    db_filename: Name of the database
-    tablename: View to expose giving the impression of a table
-    csv_filename: Folder containing the split CSV files
-    **kwargs: Options for DuckDB's read_csv function, see https://duckdb.org/docs/data/csv/overview
-    """
-    import duckdb
-    import os
-    duckdb_con = duckdb.connect(db_filename)
-    schema = {tablename : {
-        "fact" : tablename + "_fact",
-        "dimension_tables" : {},
-        "col_to_table_map" : {}
-    }}
-    # read_csv_args_list = ["'{}'".format(csv_filename)]
-    # for key, value in kwargs.items():
-    #     read_csv_args_list.append("{0} = {1}".format(key, value))
-    # read_csv_args = ','.join(read_csv_args_list)
-    num_dims = 0
-    cols = []
-    sub_tablenames = []
-    for root, dirs, files in os.walk(split_csv_foldername):
-        for file in files:
-            sub_tablename = tablename + "_" + file.split(".csv")[0]
-            sub_tablenames.append(sub_tablename)
-            if 'dim' in file:
-                num_dims += 1
-                # Assuming that dimension tables are named dimx.csv
-                dim_no = sub_tablename.split("dim")[1]
-                schema[tablename]["dimension_tables"][sub_tablename] = 'p' + dim_no
-            full_filename = root + '/' + file
-            sql_stmt = "CREATE TABLE {} AS SELECT * FROM read_csv('{}', AUTO_DETECT=TRUE)".format(sub_tablename, full_filename)
-            print(sql_stmt)
-            duckdb_con.sql(sql_stmt)
-            table = duckdb_con.table(sub_tablename)
-            for col in table.columns:
-                # HACK: not fool proof, the CSV could contain a column starting with letter 'p'
-                if col[0] == 'p':
-                    continue
-                cols.append('"' + col + '"')
-                schema[tablename]['col_to_table_map'][col] = sub_tablename
-
-    # Now create a view corresponding to a single original csv file
-    join_clauses = []
-    for i in range(num_dims):
-        join_clause = "{}_fact.p{} = {}_dim{}.p{}".format(tablename, i, tablename, i, i)
-        join_clauses.append(join_clause)
-
-    sql_stmt = "CREATE VIEW {} AS SELECT ".format(tablename) + ",".join(cols) + \
-        " FROM " + ",".join(sub_tablenames) + " WHERE " + (" AND ").join(join_clauses)
-    print(sql_stmt)
-    duckdb_con.sql(sql_stmt)
-    duckdb_con.close()
-    return schema
+# The notebooks run from their own folder, the splitting package is at the
+# root of the repository
+sys.path.append(os.path.abspath(os.path.join("..", "..")))
+from splitting.loader import init_ddb_from_csv, init_ddb_from_split_csv
 
 
 # In[2]:
@@ -1,70 +1,36 @@
+import json
 import sys
 
-if len(sys.argv) != 2:
-	print "Usage: python2 parse_stats.py <stat_file_name>"
-	exit()
+MB = 1000000.0
 
-fname = sys.argv[1]
-f = open(fname, 'r')
-csv_to_arrow = 0
-arrow_to_velox = 0
-decomposition = 0
-velox_to_arrow = 0
-arrow_to_csv = 0
-decomposition_total = 0
-for line in f:
-	if (line[0] == "*"):
-		# Reset
-		csv_to_arrow = 0
-		arrow_to_velox = 0
-		decomposition = 0
-		velox_to_arrow = 0
-		arrow_to_csv = 0
-		decomposition_total = 0
-		print line
-		continue
-	if "Time for loading CSV into Arrow" in line:
-		t = line.split(":")[1]
-		t = t.split("ns")[0]
-		t = int(t)
-		csv_to_arrow += t
-	if "Time for porting from Arrow to Velox" in line:
-		t = line.split(":")[1]
-		t = t.split("ns")[0]
-		t = int(t)
-		arrow_to_velox += t
-	if "Time for decomposition" in line:
-		t = line.split(":")[1]
-		t = t.split("ns")[0]
-		t = int(t)
-		decomposition += t
-	if "Time to port velox to arrow" in line:
-		t = line.split(":")[1]
-		t = t.split("ns")[0]
-		t = int(t)
-		velox_to_arrow += t
-	if "Time to store to CSV" in line:
-		t = line.split(":")[1]
-		t = t.split("ns")[0]
-		t = int(t)
-		arrow_to_csv += t
-	if "Decomposed CSV SIZE total" in line:
-		print "Time for loading CSV into Arrow: ", csv_to_arrow, " ns"
-		print "Time for porting from Arrow to Velox: ", arrow_to_velox, " ns"
-		print "Time for decomposition: ", decomposition, " ns"
-		print "Time to port velox to arrow: ", velox_to_arrow, " ns"
-		print "Time to store to CSV: ", arrow_to_csv, " ns"
-		print line
-		continue
-	if "Decomposition time" in line:
-		print line
-		continue
-	if "ZIP SIZE" in line:
-		print line
-		continue
-	if "Zip creation time" in line:
-		print line
-		continue
+if len(sys.argv) < 2:
+	print("USAGE: python3 parse_stats.py <stats.json written by split_csv --stats_json> ...")
+	exit(1)
 
-	
-f.close()
\ No newline at end of file
+# Summarize each run, then the total over all of them
+total_phases = {}
+total_in = 0
+total_out = 0
+for fname in sys.argv[1:]:
+	with open(fname) as f:
+		stats = json.load(f)
+	print("******", stats["input"], "******")
+	print("Rows:", stats["num_rows"], "Columns:", stats["num_columns"], "Split:", stats["split"])
+	for phase, times in stats["phases"].items():
+		total_phases[phase] = total_phases.get(phase, 0) + times["wall_ns"]
+		print("Time for " + phase + ":", times["wall_ns"], "ns", ("(CPU " + str(times["cpu_ns"]) + " ns)") if "cpu_ns" in times else "")
+	print("Peak memory (max RSS):", stats["peak_memory_bytes"]["max_rss"]/MB, "MB")
+	for group in stats["column_groups"]:
+		print(group["dimension"] + ":", group["cardinality"], "rows,", ", ".join(group["columns"]))
+	total_in += stats["bytes_in"]
+	total_out += stats["bytes_out"] if stats["split"] else stats["bytes_in"]
+	print("")
+
+if len(sys.argv) > 2:
+	print("****** Total ******")
+	for phase, wall_ns in total_phases.items():
+		print("Time for " + phase + ":", wall_ns, "ns")
+print("Size of original CSV:", total_in/MB, "MB")
+print("Size of split CSV:", total_out/MB, "MB")
+if total_out > 0:
+	print("Compressed by", round(total_in/total_out, 1), "x")
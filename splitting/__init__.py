@@ -0,0 +1 @@
+"""Python tools around the split_csv binary."""
@@ -0,0 +1,296 @@
+"""Benchmark loading datasets (original or split) with several engines.
+
+Usage: python -m splitting.benchmark folder [folder ...] [--engines pyarrow,pandas,duckdb,ibis]
+	[--warmup N] [--repeat N] [--cold-cache] [--output results.json|results.csv]
+
+Every repetition runs in a fresh process, which loads all the files of a folder
+with one engine and measures the time of each file, the total time and its own
+peak RSS. The files are CSV, possibly compressed, Parquet or Arrow IPC, as
+written by split_csv with any --format and --compression. The summary gives the median and percentiles over the repetitions.
+"""
+
+import argparse
+import csv
+import functools
+import json
+import os
+import resource
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+MB = 1000000.0
+PERCENTILES = [10, 50, 90, 99]
+# The files an original dataset or split_csv (any --format and --compression) consists of
+DATA_EXTENSIONS = (".csv", ".csv.gz", ".csv.zst", ".csv.lz4", ".parquet", ".arrow")
+
+
+def find_files(folder, extensions=DATA_EXTENSIONS):
+	files = []
+	for root, dirs, names in os.walk(folder):
+		for name in names:
+			if name.endswith(extensions):
+				files.append(os.path.join(root, name))
+	return sorted(files)
+
+
+class PyArrowEngine:
+	"""pyarrow read of every data file."""
+
+	def units(self, folder):
+		return find_files(folder)
+
+	def load(self, filename):
+		if filename.endswith(".parquet"):
+			import pyarrow.parquet as pq
+			return pq.read_table(filename)
+		if filename.endswith(".arrow"):
+			import pyarrow as pa
+			with pa.OSFile(filename) as f:
+				return pa.ipc.open_file(f).read_all()
+		# Decompresses .csv.gz, .csv.zst and .csv.lz4 by their extension
+		from pyarrow import csv as pa_csv
+		return pa_csv.read_csv(filename)
+
+	def close(self):
+		pass
+
+
+class PandasEngine:
+	"""pandas read of every data file."""
+
+	def units(self, folder):
+		return find_files(folder)
+
+	def load(self, filename):
+		import pandas as pd
+		if filename.endswith(".parquet"):
+			return pd.read_parquet(filename)
+		if filename.endswith(".arrow"):
+			return pd.read_feather(filename)
+		if filename.endswith(".lz4"):
+			raise ValueError("pandas cannot read LZ4 compressed CSV: " + filename)
+		try:
+			return pd.read_csv(filename)
+		except UnicodeDecodeError:
+			return pd.read_csv(filename, encoding="latin-1")
+
+	def close(self):
+		pass
+
+
+class DuckDBEngine:
+	"""Every data file copied into a table of an in-memory DuckDB database."""
+
+	def __init__(self):
+		self.con = None
+		self.num_tables = 0
+
+	def units(self, folder):
+		return find_files(folder)
+
+	def load(self, filename):
+		import duckdb
+		from splitting.loader import _read_function
+		if self.con is None:
+			self.con = duckdb.connect()
+		tablename = "t" + str(self.num_tables)
+		self.num_tables += 1
+		try:
+			self.con.execute("CREATE TABLE {} AS SELECT * FROM {}".format(tablename,
+				_read_function(filename, "AUTO_DETECT = TRUE")))
+		except duckdb.Error:
+			# Sniff the types on the whole file
+			self.con.execute("CREATE TABLE {} AS SELECT * FROM {}".format(tablename,
+				_read_function(filename, "AUTO_DETECT = TRUE, SAMPLE_SIZE = -1")))
+		return self.con.table(tablename)
+
+	def close(self):
+		if self.con is not None:
+			self.con.close()
+			self.con = None
+
+
+class IbisSplitEngine:
+	"""Every split folder (with a fact table) exposed as one Ibis table over DuckDB."""
+
+	def __init__(self, mode="copy"):
+		self.mode = mode
+		# The database (a copy of the dataset in copy mode) only lives for
+		# one repetition
+		self.tmpdir = None
+		self.connections = []
+		self.num_tables = 0
+
+	def units(self, folder):
+		return sorted(os.path.dirname(fact) for fact in find_files(folder, "")
+			if os.path.basename(fact).startswith("fact."))
+
+	def load(self, split_folder):
+		import ibis
+		from splitting.loader import init_ddb_from_split_csv
+		if self.tmpdir is None:
+			self.tmpdir = tempfile.TemporaryDirectory()
+		db_filename = os.path.join(self.tmpdir.name, "benchmark.db")
+		tablename = "t" + str(self.num_tables)
+		self.num_tables += 1
+
+		schema = init_ddb_from_split_csv(db_filename, tablename, split_folder, mode=self.mode, verbose=False)
+		con = ibis.duckdb.connect(db_filename)
+		self.connections.append(con)
+		if not hasattr(con, "register_schema"):
+			raise RuntimeError("the ibis engines need the ibis fork with register_schema (the ibis submodule)")
+		con.register_schema(schema)
+		table = con.table(tablename)
+		table.count().execute()
+		return table
+
+	def close(self):
+		for con in self.connections:
+			# Older ibis versions have no disconnect()
+			if hasattr(con, "disconnect"):
+				con.disconnect()
+		self.connections = []
+		if self.tmpdir is not None:
+			self.tmpdir.cleanup()
+			self.tmpdir = None
+
+
+ENGINES = {
+	"pyarrow": PyArrowEngine,
+	"pandas": PandasEngine,
+	"duckdb": DuckDBEngine,
+	"ibis": IbisSplitEngine,
+	"ibis-lazy": functools.partial(IbisSplitEngine, mode="lazy"),
+	"ibis-hybrid": functools.partial(IbisSplitEngine, mode="hybrid"),
+}
+
+
+def evict_from_cache(path):
+	"""Asks the kernel to drop the cached pages of the files under path."""
+	files = [path] if os.path.isfile(path) else find_files(path, "")
+	for filename in files:
+		fd = os.open(filename, os.O_RDONLY)
+		try:
+			os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+		finally:
+			os.close(fd)
+
+
+def run_once(engine_name, folder, cold_cache):
+	"""One repetition, in its own process: returns the time of each unit, the
+	total time and the peak RSS of the process."""
+	engine = ENGINES[engine_name]()
+	units = engine.units(folder)
+	if not units:
+		# Otherwise the folder would look like it loads instantly
+		raise ValueError("nothing for " + engine_name + " to load in " + folder)
+	if cold_cache:
+		for unit in units:
+			evict_from_cache(unit)
+	loaded = []
+	times = {}
+	try:
+		start = time.perf_counter_ns()
+		for unit in units:
+			unit_start = time.perf_counter_ns()
+			loaded.append(engine.load(unit))
+			times[os.path.relpath(unit, folder)] = time.perf_counter_ns() - unit_start
+		total = time.perf_counter_ns() - start
+	finally:
+		loaded = []
+		engine.close()
+	# ru_maxrss is in kilobytes on Linux
+	max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+	return {"unit_ns": times, "total_ns": total, "max_rss_bytes": max_rss}
+
+
+def percentile(values, q):
+	"""q-th percentile, interpolated between the closest ranks."""
+	values = sorted(values)
+	rank = (len(values) - 1) * q / 100.0
+	low = int(rank)
+	high = min(low + 1, len(values) - 1)
+	return values[low] + (values[high] - values[low]) * (rank - low)
+
+
+def summarize(values):
+	summary = {"n": len(values), "min": min(values), "max": max(values), "mean": sum(values) / len(values)}
+	for q in PERCENTILES:
+		summary["p" + str(q)] = percentile(values, q)
+	summary["median"] = summary["p50"]
+	return summary
+
+
+def benchmark(folder, engine_name, warmup, repeat, cold_cache):
+	runs = []
+	for i in range(warmup + repeat):
+		# A fresh process per repetition, so that caches of the engine and the
+		# peak RSS do not carry over
+		with ProcessPoolExecutor(max_workers=1, mp_context=get_context("spawn")) as pool:
+			run = pool.submit(run_once, engine_name, folder, cold_cache).result()
+		if i >= warmup:
+			runs.append(run)
+	units = runs[0]["unit_ns"].keys() if runs else []
+	return {
+		"folder": folder,
+		"engine": engine_name,
+		"cold_cache": cold_cache,
+		"total_ns": summarize([run["total_ns"] for run in runs]),
+		"max_rss_bytes": summarize([run["max_rss_bytes"] for run in runs]),
+		"unit_ns": {unit: summarize([run["unit_ns"][unit] for run in runs]) for unit in units},
+		"runs": runs,
+	}
+
+
+def write_csv(filename, results):
+	with open(filename, "w", newline="") as f:
+		writer = csv.writer(f)
+		stats = ["n", "min", "max", "mean"] + ["p" + str(q) for q in PERCENTILES]
+		writer.writerow(["folder", "engine", "cold_cache", "metric", "file"] + stats)
+		for result in results:
+			rows = [("total_ns", "", result["total_ns"]), ("max_rss_bytes", "", result["max_rss_bytes"])]
+			rows += [("unit_ns", unit, summary) for unit, summary in result["unit_ns"].items()]
+			for metric, unit, summary in rows:
+				writer.writerow([result["folder"], result["engine"], result["cold_cache"], metric, unit]
+					+ [summary[stat] for stat in stats])
+
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+	parser.add_argument("folders", nargs="+", help="datasets to load, e.g. data/ split_dataset/")
+	parser.add_argument("--engines", default="pyarrow,pandas,duckdb",
+		help="comma separated, among " + ", ".join(ENGINES) + " (default: %(default)s)")
+	parser.add_argument("--warmup", type=int, default=1, help="repetitions run first and discarded (default: %(default)s)")
+	parser.add_argument("--repeat", type=int, default=5, help="measured repetitions (default: %(default)s)")
+	parser.add_argument("--cold-cache", action="store_true",
+		help="evict the files from the page cache before every repetition")
+	parser.add_argument("--output", help="write the results to this .json or .csv file")
+	args = parser.parse_args()
+
+	engines = args.engines.split(",")
+	for engine in engines:
+		if engine not in ENGINES:
+			parser.error("unknown engine " + engine)
+	if args.repeat < 1:
+		parser.error("--repeat must be at least 1")
+
+	results = []
+	for folder in args.folders:
+		for engine in engines:
+			result = benchmark(folder, engine, args.warmup, args.repeat, args.cold_cache)
+			results.append(result)
+			print("Loading", folder, "with", engine + ":", "median", result["total_ns"]["median"], "ns,",
+				"p90", result["total_ns"]["p90"], "ns,", "peak RSS", result["max_rss_bytes"]["max"]/MB, "MB")
+
+	if args.output is not None:
+		if args.output.endswith(".csv"):
+			write_csv(args.output, results)
+		else:
+			with open(args.output, "w") as f:
+				json.dump(results, f, indent=1)
+
+
+if __name__ == "__main__":
+	main()
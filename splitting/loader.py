@@ -0,0 +1,168 @@
+"""Load original and split CSV files into DuckDB, for querying through Ibis.
+
+The functions return the schema that the ibis fork's con.register_schema()
+expects: {tablename: {"fact": ..., "dimension_tables": {table: key},
+"col_to_table_map": {column: table}}}.
+
+The tables of a split dataset can be created in one of three modes:
+- "copy": every file is copied into a DuckDB table (what the notebooks did)
+- "lazy": every file is a view over read_csv/read_parquet, nothing is copied
+  and each query reads only the files (and, for Parquet, the columns) it needs
+- "hybrid": the fact table is copied, the (small) dimension tables are views
+
+The combined view LEFT JOINs the fact table to every dimension on its key.
+The key of a dimension is unique (split_csv writes one row per key) and every
+fact row has one, so the join keeps exactly the fact rows. Copied dimension
+tables get a unique index on their key.
+"""
+
+import json
+import os
+
+MODES = ["copy", "lazy", "hybrid"]
+
+
+def _read_function(filename, read_csv_args):
+	"""DuckDB table function reading a file written by split_csv."""
+	if filename.endswith(".parquet"):
+		return "read_parquet('{}')".format(filename)
+	if filename.endswith(".arrow"):
+		raise ValueError("DuckDB cannot read Arrow IPC files, split with --format=csv or parquet: " + filename)
+	# Also reads .csv.gz and .csv.zst
+	return "read_csv('{}', {})".format(filename, read_csv_args)
+
+
+def _split_layout(split_csv_foldername):
+	"""Fact file, (file, key column, columns or None) of every dimension, and
+	the columns of the original file in their order, or None.
+
+	Uses the schema.json written by split_csv, and otherwise assumes that
+	dimN.* has the key pN."""
+	schema_file = os.path.join(split_csv_foldername, "schema.json")
+	if os.path.isfile(schema_file):
+		with open(schema_file) as f:
+			schema = json.load(f)
+		dims = [(dim["file"], dim["key"], [column["name"] for column in dim["columns"]])
+			for dim in schema["dimensions"]]
+		return schema["fact"]["file"], dims, [column["name"] for column in schema["columns"]]
+
+	fact_file = None
+	dims = []
+	for file in sorted(os.listdir(split_csv_foldername)):
+		name = file.split(".")[0]
+		if name == "fact":
+			fact_file = file
+		elif name.startswith("dim") and name[len("dim"):].isdigit():
+			dims.append((file, "p" + name[len("dim"):], None))
+	if fact_file is None:
+		raise ValueError("no fact table in " + split_csv_foldername)
+	return fact_file, dims, None
+
+
+def init_ddb_from_csv(db_filename, tablename, csv_filename, **kwargs):
+	"""
+	Load from the csv file into a DuckDB database.
+
+	db_filename: Name of the database
+	tablename: Table to load to
+	csv_filename: CSV file to load from
+	**kwargs: Options for DuckDB's read_csv function, see https://duckdb.org/docs/data/csv/overview
+	"""
+	import duckdb
+	duckdb_con = duckdb.connect(db_filename)
+	read_csv_args_list = ["'{}'".format(csv_filename)]
+	schema = {tablename: {
+		"fact": tablename + "_fact",
+		"dimension_tables": {},
+		"col_to_table_map": {}
+	}}
+	for key, value in kwargs.items():
+		read_csv_args_list.append("{0} = {1}".format(key, value))
+	read_csv_args = ','.join(read_csv_args_list)
+	sql_stmt = "CREATE TABLE {} AS SELECT * FROM read_csv({}, AUTO_DETECT=TRUE)".format(tablename, read_csv_args)
+	print(sql_stmt)
+	duckdb_con.sql(sql_stmt)
+	table = duckdb_con.table(tablename)
+	for col in table.columns:
+		schema[tablename]["col_to_table_map"][col] = schema[tablename]["fact"]
+	duckdb_con.close()
+	return schema
+
+
+def init_ddb_from_split_csv(db_filename, tablename, split_csv_foldername, mode="copy", verbose=True, **kwargs):
+	"""
+	Load the split csv files into a DuckDB database and expose a view with tablename
+
+	db_filename: Name of the database
+	tablename: View to expose giving the impression of a table
+	split_csv_foldername: Folder containing the split CSV (or Parquet) files
+	mode: "copy", "lazy" or "hybrid", see the module documentation
+	verbose: Print the SQL statements
+	**kwargs: Options for DuckDB's read_csv function, see https://duckdb.org/docs/data/csv/overview
+	"""
+	import duckdb
+	if mode not in MODES:
+		raise ValueError("mode must be one of " + ", ".join(MODES))
+	duckdb_con = duckdb.connect(db_filename)
+	schema = {tablename: {
+		"fact": tablename + "_fact",
+		"dimension_tables": {},
+		"col_to_table_map": {}
+	}}
+	read_csv_args_list = ["AUTO_DETECT = TRUE"]
+	for key, value in kwargs.items():
+		read_csv_args_list.append("{0} = {1}".format(key, value))
+	read_csv_args = ','.join(read_csv_args_list)
+
+	fact_file, dims, original_columns = _split_layout(split_csv_foldername)
+	tables = [(tablename + "_fact", fact_file, None, None, mode != "lazy")]
+	for i, (file, key, columns) in enumerate(dims):
+		tables.append((tablename + "_dim" + str(i), file, key, columns, mode == "copy"))
+
+	cols = []
+	keys = [key for file, key, columns in dims]
+	for sub_tablename, file, key, columns, copy in tables:
+		# Views read the file on every query, from wherever it is run
+		full_filename = os.path.abspath(os.path.join(split_csv_foldername, file))
+		sql_stmt = "CREATE {} {} AS SELECT * FROM {}".format("TABLE" if copy else "VIEW", sub_tablename,
+			_read_function(full_filename, read_csv_args))
+		if verbose:
+			print(sql_stmt)
+		duckdb_con.sql(sql_stmt)
+		if key is not None and copy:
+			# Declares the key unique (an ART index) for the joins, views cannot be indexed
+			sql_stmt = 'CREATE UNIQUE INDEX {0}_{1} ON {0} ("{1}")'.format(sub_tablename, key)
+			if verbose:
+				print(sql_stmt)
+			duckdb_con.sql(sql_stmt)
+		if key is not None:
+			schema[tablename]["dimension_tables"][sub_tablename] = key
+		if columns is None:
+			columns = duckdb_con.table(sub_tablename).columns
+		for col in columns:
+			# The keys only exist in the split tables
+			if col in keys:
+				continue
+			cols.append(col)
+			schema[tablename]['col_to_table_map'][col] = sub_tablename
+
+	if original_columns is not None:
+		# Same columns, in the same order, as the table of the original file
+		cols = [col for col in original_columns if col in schema[tablename]['col_to_table_map']] + \
+			[col for col in cols if col not in original_columns]
+		schema[tablename]['col_to_table_map'] = {col: schema[tablename]['col_to_table_map'][col] for col in cols}
+
+	# Now create a view corresponding to a single original csv file, a star
+	# join of the fact table with every dimension
+	join_clauses = []
+	for i, key in enumerate(keys):
+		join_clause = ' LEFT JOIN {1}_dim{2} ON {1}_fact."{0}" = {1}_dim{2}."{0}"'.format(key, tablename, i)
+		join_clauses.append(join_clause)
+
+	sql_stmt = "CREATE VIEW {} AS SELECT ".format(tablename) + ",".join('"' + col + '"' for col in cols) + \
+		" FROM " + tablename + "_fact" + "".join(join_clauses)
+	if verbose:
+		print(sql_stmt)
+	duckdb_con.sql(sql_stmt)
+	duckdb_con.close()
+	return schema
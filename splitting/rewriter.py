@@ -0,0 +1,189 @@
+"""SQL over the tables of a split dataset that reads only the tables a query needs.
+
+SplitTable takes the schema returned by splitting.loader (the one passed to
+con.register_schema()) and builds the SQL of common queries directly over the
+fact and dimension tables, instead of over the combined view:
+
+	from splitting.loader import init_ddb_from_split_csv
+	from splitting.rewriter import SplitTable
+	schema = init_ddb_from_split_csv("us_accidents.db", "accidents", "US_Accidents_Dec21_updated_split")
+	accidents = SplitTable(schema, "accidents")
+	con.sql(accidents.count())
+	con.sql(accidents.select(["Start_Lat"]))
+	con.sql(accidents.group_by(["State"], [("count", "count", None)]))
+	con.sql(accidents.count(where=[("State", "!=", "NY")]))
+
+A dimension is joined only when the query references one of its columns. The
+key of a dimension is unique and every fact row has one, so the LEFT JOIN
+keeps exactly the fact rows and leaving it out does not change the result.
+
+A group by on dimension columns whose aggregates only read fact columns is
+computed in two steps: the fact rows are first aggregated per key pN (an
+integer group by on the fact table alone), and only these partial aggregates
+are joined to the dimension and combined per value of its columns.
+
+Filters are lists of (column, operator, value), all of which must hold. The
+ones on the columns of a dimension are evaluated on the dimension table
+alone, and the fact rows are then filtered by their key, pN IN (SELECT pN
+FROM dimN WHERE ...), so that filtering only reads an integer column of
+the fact table and does not join the dimension.
+"""
+
+AGGREGATES = ["count", "sum", "min", "max", "avg"]
+OPERATORS = ["=", "!=", "<", "<=", ">", ">=", "in", "not in", "is null", "is not null"]
+
+
+def quote(name):
+	return '"' + name.replace('"', '""') + '"'
+
+
+def literal(value):
+	if value is None:
+		return "NULL"
+	if isinstance(value, bool):
+		return "TRUE" if value else "FALSE"
+	if isinstance(value, (int, float)):
+		return repr(value)
+	return "'" + str(value).replace("'", "''") + "'"
+
+
+class SplitTable:
+	"""Builds SQL over the split tables of tablename in schema."""
+
+	def __init__(self, schema, tablename):
+		entry = schema[tablename]
+		self.tablename = tablename
+		self.fact = entry["fact"]
+		# Dimension table -> key column, in the order of the split
+		self.keys = entry["dimension_tables"]
+		self.col_to_table = entry["col_to_table_map"]
+		self.columns = list(self.col_to_table)
+
+	def table_of(self, column):
+		if column not in self.col_to_table:
+			raise ValueError("no column " + column + " in " + self.tablename)
+		return self.col_to_table[column]
+
+	def column(self, column):
+		"""Qualified name of column."""
+		return self.table_of(column) + "." + quote(column)
+
+	def dimensions(self, columns):
+		"""Dimension tables holding some of columns, in the order of the split."""
+		tables = set(self.table_of(column) for column in columns)
+		return [dim for dim in self.keys if dim in tables]
+
+	def join(self, dims):
+		"""The fact table joined to dims."""
+		sql = self.fact
+		for dim in dims:
+			key = quote(self.keys[dim])
+			sql += " LEFT JOIN {1} ON {0}.{2} = {1}.{2}".format(self.fact, dim, key)
+		return sql
+
+	def _predicate(self, column, op, value):
+		if op not in OPERATORS:
+			raise ValueError("operator must be one of " + ", ".join(OPERATORS))
+		sql = self.column(column) + " " + op.upper()
+		if op in ("in", "not in"):
+			if not value:
+				# IN () is a syntax error
+				return "FALSE" if op == "in" else "TRUE"
+			return sql + " (" + ", ".join(literal(item) for item in value) + ")"
+		if op in ("is null", "is not null"):
+			return sql
+		return sql + " " + literal(value)
+
+	def where(self, where):
+		"""WHERE clause over the fact table for the filters in where."""
+		if not where:
+			return ""
+		conditions = []
+		by_dim = {}
+		for column, op, value in where:
+			table = self.table_of(column)
+			if table == self.fact:
+				conditions.append(self._predicate(column, op, value))
+			else:
+				by_dim.setdefault(table, []).append(self._predicate(column, op, value))
+		for dim in self.keys:
+			if dim in by_dim:
+				key = quote(self.keys[dim])
+				conditions.append("{0}.{2} IN (SELECT {1}.{2} FROM {1} WHERE {3})".format(
+					self.fact, dim, key, " AND ".join(by_dim[dim])))
+		return " WHERE " + " AND ".join(conditions)
+
+	def select(self, columns=None, where=None, limit=None):
+		"""SELECT of columns (all of them by default) of the rows matching where."""
+		if columns is None:
+			columns = self.columns
+		sql = "SELECT " + ", ".join(self.column(column) for column in columns) + \
+			" FROM " + self.join(self.dimensions(columns)) + self.where(where)
+		if limit is not None:
+			sql += " LIMIT " + str(int(limit))
+		return sql
+
+	def count(self, where=None):
+		"""Number of rows matching where, counted on the fact table."""
+		return "SELECT count(*) FROM " + self.fact + self.where(where)
+
+	def _aggregate(self, func, column):
+		if func not in AGGREGATES:
+			raise ValueError("aggregate must be one of " + ", ".join(AGGREGATES))
+		if column is None:
+			if func != "count":
+				raise ValueError(func + " needs a column")
+			return "count(*)"
+		return func + "(" + self.column(column) + ")"
+
+	def group_by(self, keys, aggregates, where=None):
+		"""SELECT keys, aggregates WHERE where GROUP BY keys.
+
+		aggregates is a list of (name, function, column), where function is one
+		of AGGREGATES and column is None for count(*)."""
+		for name, func, column in aggregates:
+			self._aggregate(func, column)
+		dims = self.dimensions(keys)
+		if dims and all(column is None or self.table_of(column) == self.fact for name, func, column in aggregates):
+			return self._group_by_keys(keys, aggregates, dims, where)
+
+		columns = list(keys) + [column for name, func, column in aggregates if column is not None]
+		selected = [self.column(key) for key in keys] + \
+			[self._aggregate(func, column) + " AS " + quote(name) for name, func, column in aggregates]
+		sql = "SELECT " + ", ".join(selected) + " FROM " + self.join(self.dimensions(columns)) + self.where(where)
+		if keys:
+			sql += " GROUP BY " + ", ".join(self.column(key) for key in keys)
+		return sql
+
+	def _group_by_keys(self, keys, aggregates, dims, where):
+		"""group_by() aggregating the fact table per dimension key first."""
+		fact_keys = [key for key in keys if self.table_of(key) == self.fact]
+		inner_keys = [self.column(key) for key in fact_keys] + \
+			["{}.{}".format(self.fact, quote(self.keys[dim])) for dim in dims]
+		partials = []
+		finals = []
+		for i, (name, func, column) in enumerate(aggregates):
+			# Prefixed, so they do not collide with the fact columns or the keys pN
+			partial = quote("__agg" + str(i))
+			if func == "count":
+				partials.append(self._aggregate(func, column) + " AS " + partial)
+				# A sum of counts would be a HUGEINT
+				finals.append("CAST(sum(f.{}) AS BIGINT)".format(partial))
+			elif func == "avg":
+				partial_sum = quote("__agg" + str(i) + "_sum")
+				partial_count = quote("__agg" + str(i) + "_count")
+				partials.append("sum({0}) AS {1}, count({0}) AS {2}".format(self.column(column), partial_sum, partial_count))
+				finals.append("sum(f.{}) / sum(f.{})".format(partial_sum, partial_count))
+			else:
+				partials.append(self._aggregate(func, column) + " AS " + partial)
+				finals.append("{}(f.{})".format(func, partial))
+
+		inner = "SELECT " + ", ".join(inner_keys + partials) + " FROM " + self.fact + self.where(where) + \
+			" GROUP BY " + ", ".join(inner_keys)
+		outer_keys = ["f." + quote(key) if key in fact_keys else self.column(key) for key in keys]
+		sql = "SELECT " + ", ".join([key + " AS " + quote(name) for key, name in zip(outer_keys, keys)] +
+			[final + " AS " + quote(name) for final, (name, func, column) in zip(finals, aggregates)])
+		sql += " FROM (" + inner + ") AS f"
+		for dim in dims:
+			sql += " LEFT JOIN {0} ON f.{1} = {0}.{1}".format(dim, quote(self.keys[dim]))
+		return sql + " GROUP BY " + ", ".join(outer_keys)
@@ -0,0 +1,195 @@
+"""Split every CSV file of a dataset folder with split_csv, several files at a time.
+
+Usage: python -m splitting.split_dataset dataset_folder [dest_folder] [-j N] [--force] [split_csv options]
+
+Each file is split straight into its own folder, dest_folder/<path of the file
+without .csv>/, so the runs do not collide. Files that split_csv does not split
+are copied as fact.csv. Options that are not recognized (e.g. --format=parquet)
+are passed on to split_csv.
+
+dest_folder/manifest.json records, for every file, its size, mtime and content
+hash, the split_csv version and options, and the column groups of the split.
+A file whose fingerprint still matches and whose outputs still exist is not
+split again.
+"""
+
+import argparse
+import csv as csv_module
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+from concurrent.futures import ProcessPoolExecutor
+
+MB = 1000000.0
+SPLIT_CSV = "velox/_build/release/velox/examples/split_csv"
+MANIFEST = "manifest.json"
+SCHEMA = "schema.json"
+GROUPING = "grouping.json"
+
+
+def find_csvs(dataset_folder):
+	csvs = []
+	for root, dirs, files in os.walk(dataset_folder):
+		for file in files:
+			if file.endswith(".csv"):
+				csvs.append(os.path.join(root, file))
+	return sorted(csvs)
+
+
+def folder_name(csv, dataset_folder):
+	# Same layout as scripts/gen_folder_name.py
+	return os.path.splitext(os.path.relpath(csv, dataset_folder))[0]
+
+
+def split_outputs(dest):
+	# dest may also hold the folders of other files of the dataset
+	return sorted(file for file in os.listdir(dest)
+		if (file.startswith("fact.") or file.startswith("dim") or file in (SCHEMA, GROUPING))
+		and os.path.isfile(os.path.join(dest, file)))
+
+
+def split_csv_version(split_csv):
+	result = subprocess.run([split_csv, "--version"], stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+	return result.stdout.strip()
+
+
+def content_hash(filename):
+	sha = hashlib.sha256()
+	with open(filename, "rb") as f:
+		for block in iter(lambda: f.read(1 << 20), b""):
+			sha.update(block)
+	return sha.hexdigest()
+
+
+def column_groups(dest, outputs):
+	"""Columns of every dimension table, from schema.json or else the CSV headers."""
+	if SCHEMA in outputs:
+		with open(os.path.join(dest, SCHEMA)) as f:
+			schema = json.load(f)
+		return [[column["name"] for column in dim["columns"]] for dim in schema["dimensions"]]
+	groups = []
+	for file in outputs:
+		if file.startswith("dim") and file.endswith(".csv"):
+			with open(os.path.join(dest, file), newline="") as f:
+				header = next(csv_module.reader(f), [])
+			# The last column is the key of the dimension
+			groups.append(header[:-1])
+	return groups
+
+
+def is_unchanged(csv, dest, entry, fingerprint):
+	if entry is None or any(entry.get(key) != value for key, value in fingerprint.items()):
+		return False
+	if not all(os.path.isfile(os.path.join(dest, file)) for file in entry["outputs"]):
+		return False
+	stat = os.stat(csv)
+	if stat.st_size != entry["size"]:
+		return False
+	# Touched but maybe not modified, compare the contents
+	if stat.st_mtime_ns != entry["mtime_ns"] and content_hash(csv) != entry["sha256"]:
+		return False
+	return True
+
+
+def split_file(split_csv, split_args, csv, dest, entry, fingerprint):
+	"""Splits one CSV into dest unless it did not change since the split recorded
+	in entry, returns its new manifest entry and whether it was split."""
+	if is_unchanged(csv, dest, entry, fingerprint):
+		return dict(entry, mtime_ns=os.stat(csv).st_mtime_ns), False
+
+	os.makedirs(dest, exist_ok=True)
+	for file in split_outputs(dest):
+		os.remove(os.path.join(dest, file))
+
+	stat = os.stat(csv)
+	sha256 = content_hash(csv)
+	result = subprocess.run([split_csv, "--output_dir=" + dest] + split_args + [csv],
+		stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+	if result.returncode != 0:
+		raise RuntimeError("split_csv failed on " + csv + ":\n" + result.stdout)
+	outputs = split_outputs(dest)
+	if not any(file.startswith("fact.") for file in outputs):
+		# Not split, the original file is the fact table
+		shutil.copy(csv, os.path.join(dest, "fact.csv"))
+		outputs = split_outputs(dest)
+
+	entry = dict(fingerprint, size=stat.st_size, mtime_ns=stat.st_mtime_ns, sha256=sha256,
+		outputs=outputs, column_groups=column_groups(dest, outputs))
+	return entry, True
+
+
+def write_manifest(filename, manifest):
+	with open(filename + ".tmp", "w") as f:
+		json.dump(manifest, f, indent=1, sort_keys=True)
+	os.replace(filename + ".tmp", filename)
+
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+	parser.add_argument("dataset_folder")
+	parser.add_argument("dest_folder", nargs="?", default="split_dataset/")
+	parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count(),
+		help="number of files split at the same time (default: number of CPUs)")
+	parser.add_argument("--split-csv", default=SPLIT_CSV,
+		help="path of the split_csv binary, which must already be built (default: %(default)s)")
+	parser.add_argument("--force", action="store_true",
+		help="split every file, even if it did not change since the last run")
+	args, split_args = parser.parse_known_args()
+
+	if not os.path.isfile(args.split_csv):
+		print("ERROR: " + args.split_csv + " not found, build it with `make release` in velox/")
+		exit(1)
+	jobs = max(1, args.jobs)
+	# The number of threads does not change the output of a split
+	fingerprint = {"split_csv_version": split_csv_version(args.split_csv),
+		"split_args": [arg for arg in split_args if not arg.startswith("--num_threads")]}
+	# Share the CPUs between the concurrent splits, unless told otherwise
+	if not any(arg.startswith("--num_threads") for arg in split_args):
+		split_args.append("--num_threads=" + str(max(1, os.cpu_count() // jobs)))
+
+	os.makedirs(args.dest_folder, exist_ok=True)
+	manifest_file = os.path.join(args.dest_folder, MANIFEST)
+	manifest = {}
+	if os.path.isfile(manifest_file) and not args.force:
+		with open(manifest_file) as f:
+			manifest = json.load(f)
+
+	csvs = find_csvs(args.dataset_folder)
+	names = [folder_name(csv, args.dataset_folder) for csv in csvs]
+	orig_size = 0
+	split_size = 0
+	with ProcessPoolExecutor(max_workers=jobs) as pool:
+		futures = []
+		for csv, name in zip(csvs, names):
+			dest = os.path.join(args.dest_folder, name)
+			futures.append(pool.submit(split_file, args.split_csv, split_args, csv, dest,
+				manifest.get(name), fingerprint))
+		for csv, name, future in zip(csvs, names, futures):
+			entry, was_split = future.result()
+			# Saved after every file, so an interrupted run keeps what it split
+			manifest[name] = entry
+			write_manifest(manifest_file, manifest)
+
+			dest = os.path.join(args.dest_folder, name)
+			num_dims = sum(1 for file in entry["outputs"] if file.startswith("dim"))
+			csv_size = entry["size"]
+			csv_split_size = sum(os.path.getsize(os.path.join(dest, file)) for file in entry["outputs"]
+				if file not in (SCHEMA, GROUPING))
+			orig_size += csv_size
+			split_size += csv_split_size
+			print(csv + ": " + ("" if was_split else "unchanged, ") + str(num_dims) + " dimension tables, "
+				+ str(csv_size/MB) + " MB -> " + str(csv_split_size/MB) + " MB, compressed by "
+				+ str(round(csv_size/max(csv_split_size, 1), 1)) + " x")
+
+	print("")
+	print("Split CSV dataset stored in folder " + args.dest_folder)
+	print("Size of original CSV dataset: " + str(orig_size/MB) + " MB")
+	print("Size of split CSV dataset: " + str(split_size/MB) + " MB")
+	if split_size > 0:
+		print("Compressed by " + str(round(orig_size/split_size, 1)) + " x")
+
+
+if __name__ == "__main__":
+	main()
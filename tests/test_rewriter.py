@@ -0,0 +1,148 @@
+"""The SQL of splitting.rewriter returns the same rows as the combined view."""
+
+import json
+
+import pytest
+
+duckdb = pytest.importorskip("duckdb")
+
+from splitting.loader import init_ddb_from_split_csv
+from splitting.rewriter import SplitTable
+
+# Original columns: ID, State, Sev, City, Wx. State and City are split into
+# dim0 (key p0), Wx into dim1 (key p1), with some nulls in the dimensions.
+FACT = """ID,Sev,p0,p1
+1,2,0,0
+2,3,0,1
+3,2,2,0
+4,4,3,2
+5,3,2,2
+6,2,5,1
+7,3,0,0
+"""
+DIM0 = """State,City,p0
+NY,New York,0
+WI,Madison,2
+WI,Milwaukee,3
+,Unknown,5
+"""
+DIM1 = """Wx,p1
+Rain,0
+Snow,1
+,2
+"""
+SCHEMA = {
+	"columns": [{"name": name} for name in ["ID", "State", "Sev", "City", "Wx"]],
+	"fact": {"file": "fact.csv"},
+	"dimensions": [
+		{"file": "dim0.csv", "key": "p0", "columns": [{"name": "State"}, {"name": "City"}]},
+		{"file": "dim1.csv", "key": "p1", "columns": [{"name": "Wx"}]},
+	],
+}
+
+
+@pytest.fixture(scope="module", params=["copy", "lazy"])
+def split(request, tmp_path_factory):
+	folder = tmp_path_factory.mktemp("split")
+	for name, contents in [("fact.csv", FACT), ("dim0.csv", DIM0), ("dim1.csv", DIM1)]:
+		(folder / name).write_text(contents)
+	(folder / "schema.json").write_text(json.dumps(SCHEMA))
+	db_filename = str(folder / "test.db")
+	schema = init_ddb_from_split_csv(db_filename, "t", str(folder), mode=request.param, verbose=False)
+	con = duckdb.connect(db_filename)
+	yield con, SplitTable(schema, "t")
+	con.close()
+
+
+def rows(con, sql):
+	# Rounded, so that averages computed in two steps compare equal
+	result = [tuple(round(value, 9) if isinstance(value, float) else value for value in row)
+		for row in con.sql(sql).fetchall()]
+	return sorted(result, key=repr)
+
+
+def test_view_columns(split):
+	con, table = split
+	assert con.table("t").columns == ["ID", "State", "Sev", "City", "Wx"]
+	assert table.columns == ["ID", "State", "Sev", "City", "Wx"]
+
+
+@pytest.mark.parametrize("where, view_where", [
+	(None, ""),
+	([("State", "!=", "NY")], ' WHERE "State" != \'NY\''),
+	([("State", "=", "WI"), ("Wx", "is null", None)], ' WHERE "State" = \'WI\' AND "Wx" IS NULL'),
+	([("City", "in", ["Madison", "New York"]), ("Sev", ">", 2)],
+		' WHERE "City" IN (\'Madison\', \'New York\') AND "Sev" > 2'),
+	([("State", "is not null", None), ("Wx", "not in", ["Rain"])],
+		' WHERE "State" IS NOT NULL AND "Wx" NOT IN (\'Rain\')'),
+	([("State", "in", [])], " WHERE FALSE"),
+	([("Wx", "not in", [])], " WHERE TRUE"),
+])
+def test_count_and_select(split, where, view_where):
+	con, table = split
+	assert rows(con, table.count(where=where)) == rows(con, "SELECT count(*) FROM t" + view_where)
+	assert rows(con, table.select(where=where)) == rows(con, "SELECT * FROM t" + view_where)
+	assert rows(con, table.select(["ID", "Sev"], where=where)) == \
+		rows(con, 'SELECT "ID", "Sev" FROM t' + view_where)
+	assert rows(con, table.select(["City", "ID"], where=where)) == \
+		rows(con, 'SELECT "City", "ID" FROM t' + view_where)
+
+
+def test_join_elimination(split):
+	con, table = split
+	assert table.count() == "SELECT count(*) FROM t_fact"
+	assert "JOIN" not in table.select(["ID", "Sev"])
+	assert "t_dim1" not in table.select(["ID", "City"])
+
+
+AGGREGATES = [("n", "count", None), ("ids", "count", "ID"), ("total", "sum", "ID"),
+	("low", "min", "ID"), ("high", "max", "ID"), ("mean", "avg", "ID")]
+VIEW_AGGREGATES = 'count(*), count("ID"), sum("ID"), min("ID"), max("ID"), avg("ID")'
+
+
+@pytest.mark.parametrize("keys, pushed_down", [
+	(["State"], True),
+	(["State", "City"], True),
+	(["Sev", "State"], True),
+	(["Wx", "Sev", "City"], True),
+	(["Sev"], False),
+])
+@pytest.mark.parametrize("where, view_where", [
+	(None, ""),
+	([("State", "!=", "NY"), ("Sev", "<", 4)], ' WHERE "State" != \'NY\' AND "Sev" < 4'),
+	([("State", "in", [])], " WHERE FALSE"),
+	([("Wx", "not in", [])], " WHERE TRUE"),
+])
+def test_group_by(split, keys, pushed_down, where, view_where):
+	con, table = split
+	sql = table.group_by(keys, AGGREGATES, where=where)
+	assert sql.startswith("SELECT") and ("AS f" in sql) == pushed_down
+	view_keys = ", ".join('"' + key + '"' for key in keys)
+	assert rows(con, sql) == rows(con, "SELECT {0}, {1} FROM t{2} GROUP BY {0}".format(
+		view_keys, VIEW_AGGREGATES, view_where))
+
+
+@pytest.mark.parametrize("keys", [["State"], ["Sev"], ["Sev", "City"]])
+def test_group_by_dimension_aggregates(split, keys):
+	# Aggregates over dimension columns are computed after the join
+	con, table = split
+	sql = table.group_by(keys, [("n", "count", None), ("weather", "min", "Wx")], where=[("ID", ">", 1)])
+	assert "AS f" not in sql
+	view_keys = ", ".join('"' + key + '"' for key in keys)
+	assert rows(con, sql) == rows(con, 'SELECT {0}, count(*), min("Wx") FROM t WHERE "ID" > 1 GROUP BY {0}'.format(
+		view_keys))
+
+
+def test_layout_without_schema(tmp_path):
+	# Without schema.json the keys come from the file names
+	for name, contents in [("fact.csv", FACT), ("dim0.csv", DIM0), ("dim1.csv", DIM1)]:
+		(tmp_path / name).write_text(contents)
+	db_filename = str(tmp_path / "test.db")
+	schema = init_ddb_from_split_csv(db_filename, "t", str(tmp_path), mode="hybrid", verbose=False)
+	table = SplitTable(schema, "t")
+	con = duckdb.connect(db_filename)
+	try:
+		assert rows(con, table.group_by(["State"], [("n", "count", None)])) == \
+			rows(con, 'SELECT "State", count(*) FROM t GROUP BY "State"')
+	finally:
+		con.close()
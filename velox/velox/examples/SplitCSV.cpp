@@ -1,10 +1,23 @@
 #include <iostream>
 #include <vector>
+#include <algorithm>
+#include <cstring>
+#include <atomic>
+#include <filesystem>
+#include <functional>
+#include <fstream>
 #include <map>
+#include <sstream>
+#include <mutex>
+#include <random>
+#include <optional>
+#include <string_view>
+#include <unordered_map>
 #include <ctime>
 #include <time.h>
 #include <sys/time.h>
 #include <sys/types.h>
+#include <sys/resource.h>
 
 #include <arrow/api.h>
 #include <arrow/csv/api.h>
@@ -13,12 +26,21 @@
 #include <arrow/api.h>
 #include <arrow/c/abi.h>
 #include <arrow/c/bridge.h>
+#include <arrow/compute/api.h>
+#include <arrow/ipc/api.h>
+#include <parquet/arrow/writer.h>
+#include <arrow/util/compression.h>
+#include <arrow/util/parallel.h>
+#include <arrow/util/thread_pool.h>
 
 #include "velox/common/base/Nulls.h"
 #include "velox/core/QueryCtx.h"
 #include "velox/vector/arrow/Bridge.h"
 
+#include <folly/futures/Future.h>
 #include <folly/init/Init.h>
+#include <folly/json.h>
+#include <gflags/gflags.h>
 #include "velox/connectors/tpch/TpchConnector.h"
 #include "velox/connectors/tpch/TpchConnectorSplit.h"
 #include "velox/core/Expressions.h"
@@ -38,32 +60,398 @@ using namespace facebook::velox::test;
 using namespace facebook::velox::exec::test;
 using namespace std;
 
+DEFINE_int64(
+	sniff_bytes,
+	1 << 20,
+	"Size in bytes of the CSV prefix parsed to learn the column names and to "
+	"check for binary columns. 0 infers the types from the whole file, which "
+	"reads the input twice.");
+
+DEFINE_bool(
+	streaming,
+	false,
+	"Read the CSV in record batches instead of loading the whole file. The "
+	"file is read once for the statistics and once for splitting, and the "
+	"fact table is written out batch by batch, so memory is bounded by the "
+	"size of the dimension tables rather than the size of the input.");
+
+DEFINE_int32(
+	num_threads,
+	0,
+	"Number of threads used for parsing the CSV and for splitting. The Arrow "
+	"CSV reader and the Velox queries share this budget (in --streaming mode, "
+	"where they run at the same time, each gets half of it). 0 uses the "
+	"number of hardware threads.");
+
+DEFINE_int64(
+	block_size,
+	1 << 20,
+	"Size in bytes of the blocks the Arrow CSV reader parses in parallel. "
+	"In --streaming mode this is also the size of a record batch.");
+
+int numThreads() {
+	return FLAGS_num_threads > 0 ? FLAGS_num_threads : std::thread::hardware_concurrency();
+}
+
+// Threads of Arrow's CPU pool (CSV parsing and encoding). In --streaming
+// mode the reader parses ahead while the batches are split on the Velox
+// executor, so the two pools split the budget instead of both using it.
+int arrowThreads() {
+	return FLAGS_streaming ? std::max(1, numThreads() / 2) : numThreads();
+}
+
+// Threads of the Velox executor (queries, group encoding, table writes)
+int veloxThreads() {
+	return FLAGS_streaming ? std::max(1, numThreads() - numThreads() / 2) : numThreads();
+}
+
+// Executor shared by all the Velox queries, sized by veloxThreads()
+shared_ptr<folly::Executor> sharedExecutor() {
+	static shared_ptr<folly::Executor> executor =
+		std::make_shared<folly::CPUThreadPoolExecutor>(veloxThreads());
+	return executor;
+}
+
+shared_ptr<core::QueryCtx> newQueryCtx() {
+	return std::make_shared<core::QueryCtx>(sharedExecutor().get());
+}
+
+DEFINE_int64(
+	sample_rows,
+	0,
+	"Decide the column groups from statistics estimated on a sample of about "
+	"this many rows instead of the whole table. 0 disables sampling.");
+
+DEFINE_double(
+	sample_fraction,
+	0,
+	"Decide the column groups from statistics estimated on this fraction of "
+	"the rows (ignored if --sample_rows is set). 0 disables sampling.");
+
+DEFINE_bool(
+	dense_keys,
+	false,
+	"Number the tuples of every dimension table 0..cardinality-1 instead of "
+	"using the row number of their first occurrence as the key. Dense keys "
+	"are smaller, and the column grouping accounts for their width.");
+
+// Printed by --version, bump it when the output of split_csv changes so that
+// cached splits are redone
+const string splitCsvVersion = "0.4.0";
+
+DEFINE_string(
+	format,
+	"csv",
+	"Output format of the fact and dimension tables: csv, parquet, or ipc "
+	"(Arrow IPC file, a.k.a. Feather V2). The binary formats store the "
+	"columns with the types inferred from the CSV, and the keys as the "
+	"narrowest unsigned integers that hold them.");
+
+DEFINE_string(
+	quoting,
+	"needed",
+	"Quoting of the CSV output: needed (only the values containing a comma, "
+	"quote or line break are quoted) or all (every non-null string value is "
+	"quoted, the keys are not).");
+
+DEFINE_string(
+	compression,
+	"none",
+	"Compression of the output tables: none, gzip, zstd or lz4. CSV files "
+	"are compressed as a whole while they are written (fact.csv.zst, ...), "
+	"Parquet and Arrow IPC files compress their columns (IPC does not "
+	"support gzip).");
+
+arrow::Compression::type outputCompression() {
+	if (FLAGS_compression == "gzip") {
+		return arrow::Compression::GZIP;
+	}
+	if (FLAGS_compression == "zstd") {
+		return arrow::Compression::ZSTD;
+	}
+	if (FLAGS_compression == "lz4") {
+		// Arrow 8 writes Parquet's LZ4 with the Hadoop framing, which many
+		// readers (e.g. older DuckDB versions) cannot read. CSV and IPC
+		// files use the LZ4 frame format.
+		return FLAGS_format == "parquet" ? arrow::Compression::LZ4 : arrow::Compression::LZ4_FRAME;
+	}
+	return arrow::Compression::UNCOMPRESSED;
+}
+
+string outputExtension() {
+	if (FLAGS_format == "parquet") {
+		return ".parquet";
+	}
+	if (FLAGS_format == "ipc") {
+		return ".arrow";
+	}
+	if (FLAGS_compression == "gzip") {
+		return ".csv.gz";
+	}
+	if (FLAGS_compression == "zstd") {
+		return ".csv.zst";
+	}
+	if (FLAGS_compression == "lz4") {
+		return ".csv.lz4";
+	}
+	return ".csv";
+}
+
+DEFINE_string(
+	output_dir,
+	".",
+	"Directory the fact and dimension tables are written to (created if "
+	"needed).");
+
+DEFINE_string(
+	output_prefix,
+	"",
+	"Prefix of the names of the output files, e.g. \"flights_\" for "
+	"flights_fact.csv and flights_dim0.csv.");
+
+DEFINE_string(
+	grouping_from,
+	"",
+	"Split with the column groups saved in this grouping.json by an earlier "
+	"run on a file with the same columns, instead of computing statistics.");
+
+// Path of the output file of a table, e.g. "fact" or "dim0"
+string outputPath(string name) {
+	return (std::filesystem::path(FLAGS_output_dir) / (FLAGS_output_prefix + name + outputExtension())).string();
+}
+
+// Size in bytes of a key of a dimension table with the given cardinality.
+// Sparse keys are row numbers and need 8 bytes, dense keys fit in the
+// narrowest of 1, 2, 4 or 8 bytes.
+int keyWidth(uint64_t cardinality) {
+	if (!FLAGS_dense_keys || cardinality > (1ULL << 32)) {
+		return 8;
+	}
+	if (cardinality <= (1ULL << 8)) {
+		return 1;
+	}
+	if (cardinality <= (1ULL << 16)) {
+		return 2;
+	}
+	return 4;
+}
+
 unsigned long getTimeDiff(struct timespec start_time, struct timespec end_time) {
     return (unsigned long)((end_time.tv_sec - start_time.tv_sec)*1000000000 +
         double(end_time.tv_nsec - start_time.tv_nsec));
     return 0;
 }
 
+DEFINE_string(
+	stats_json,
+	"",
+	"Write the wall and CPU time of each phase, peak memory, rows, bytes "
+	"read and written, and the cardinality of each column group to this "
+	"JSON file.");
+
+// Wall and CPU time (of all threads) of a phase of the run, for --stats_json
+class PhaseTime {
+public:
+	PhaseTime() {
+		clock_gettime(CLOCK_MONOTONIC, &(_wall_start));
+		clock_gettime(CLOCK_PROCESS_CPUTIME_ID, &(_cpu_start));
+	}
+	folly::dynamic stop() {
+		struct timespec wall_end, cpu_end;
+		clock_gettime(CLOCK_MONOTONIC, &(wall_end));
+		clock_gettime(CLOCK_PROCESS_CPUTIME_ID, &(cpu_end));
+		return folly::dynamic::object
+			("wall_ns", int64_t(getTimeDiff(_wall_start, wall_end)))
+			("cpu_ns", int64_t(getTimeDiff(_cpu_start, cpu_end)));
+	}
+
+private:
+	struct timespec _wall_start, _cpu_start;
+};
+
 class LoadCSVtoVelox : public VectorTestBase {
 public:
 	LoadCSVtoVelox() {}
 	~LoadCSVtoVelox() {}
-	RowVectorPtr load(string filename, map<string, string>&);
+	vector<RowVectorPtr> load(string filename, map<string, string>&);
+
+	// Streaming interface: open() (re)starts reading the file from the
+	// beginning, next() returns the next record batch or nullptr at the end
+	void open(string filename, map<string, string>&);
+	RowVectorPtr next();
+
+	// Column types Arrow inferred for the CSV before they were all read as strings
+	shared_ptr<arrow::Schema> inferred_schema() {
+		return _inferred_schema;
+	}
+	int64_t peak_memory_bytes() {
+		return pool()->getMaxBytes();
+	}
+	// Rows read (by the last pass in streaming mode) and time spent reading
+	int64_t num_rows = 0;
+	ulong csv_to_arrow_time_ns = 0;
+	ulong arrow_to_velox_time_ns = 0;
+
+private:
+	shared_ptr<arrow::csv::StreamingReader> _reader;
+	shared_ptr<arrow::Schema> _read_schema(string filename);
+	shared_ptr<arrow::Table> _read_table(string filename, const arrow::csv::ConvertOptions&);
+	arrow::csv::ReadOptions _read_options();
+	arrow::csv::ConvertOptions _string_convert_options(string filename);
+	shared_ptr<arrow::Schema> _inferred_schema;
+	RowVectorPtr _import(const vector<shared_ptr<arrow::Array>>&);
+};
+
+// Writes an output table in the format given by --format, in one or more pieces
+class TableWriter {
+public:
+	TableWriter(string filename, const shared_ptr<arrow::Schema>&);
+	~TableWriter() {}
+	void write(const arrow::Table&);
+	void close();
+
+private:
+	string _filename;
+	shared_ptr<arrow::Schema> _schema;
+	bool _header_written = false;
+	// The file, or a stream compressing into it
+	shared_ptr<arrow::io::OutputStream> _stream;
+	unique_ptr<arrow::util::Codec> _codec;
+	shared_ptr<arrow::ipc::RecordBatchWriter> _writer;
+	unique_ptr<parquet::arrow::FileWriter> _parquet_writer;
 };
 
 class StoreVeloxToCSV : public VectorTestBase {
 public:
 	StoreVeloxToCSV() {}
 	~StoreVeloxToCSV() {}
-	void store(vector<RowVectorPtr>&, RowVectorPtr&);
+	void store(vector<RowVectorPtr>&, vector<RowVectorPtr>&);
+	// Streaming: the fact table is appended batch by batch, and the
+	// dimension tables are stored once the whole input has been split
+	void append_fact(RowVectorPtr&);
+	void store_dims(vector<RowVectorPtr>&);
+	// Describes the tables that were written in schema.json
+	void store_schema();
+	// File, rows and bytes of every table written, for --stats_json
+	folly::dynamic table_stats();
+	int64_t peak_memory_bytes() {
+		return pool()->getMaxBytes();
+	}
 	void _store_single_row_vector(RowVectorPtr&, string);
-	ulong velox_to_arrow_time_ns = 0;
-	ulong arrow_to_csv_time_ns = 0;
+	// Column types inferred from the CSV, for the binary formats
+	shared_ptr<arrow::Schema> column_types;
+	std::atomic<ulong> velox_to_arrow_time_ns = 0;
+	std::atomic<ulong> arrow_to_csv_time_ns = 0;
+
+private:
+	unique_ptr<TableWriter> _fact_writer;
+	map<string, shared_ptr<arrow::DataType>> _key_types;
+	shared_ptr<arrow::RecordBatch> _to_arrow(RowVectorPtr&);
+	shared_ptr<arrow::Table> _to_arrow_table(RowVectorPtr&);
+	shared_ptr<arrow::Table> _with_output_types(const shared_ptr<arrow::Table>&, bool);
+	void _write_table(const shared_ptr<arrow::Table>&, string);
+	void _write_tables(const vector<pair<string, shared_ptr<arrow::Table>>>&);
+	void _add_dims(vector<RowVectorPtr>&, vector<pair<string, shared_ptr<arrow::Table>>>&);
+	// Writes the output tables concurrently, at most veloxThreads() at a time
+	shared_ptr<folly::Executor> _executor{sharedExecutor()};
+	// Schema and number of rows of every table written
+	struct TableInfo {
+		shared_ptr<arrow::Schema> schema;
+		int64_t num_rows = 0;
+	};
+	map<string, TableInfo> _tables;
+	std::mutex _tables_mutex;
+	void _add_rows(string, const arrow::Table&);
 };
 
+// Whether a CSV value has to be quoted
+bool _needs_quotes(std::string_view value) {
+	return value.find_first_of(",\"\r\n") != std::string_view::npos;
+}
+
+void _append_csv_field(string& out, std::string_view value, bool quote) {
+	if (!quote && !_needs_quotes(value)) {
+		out += value;
+		return;
+	}
+	out += '"';
+	for (auto c : value) {
+		if (c == '"') {
+			out += '"';
+		}
+		out += c;
+	}
+	out += '"';
+}
+
+string _csv_field(std::string_view value) {
+	string field;
+	_append_csv_field(field, value, false);
+	return field;
+}
+
+// Whether any string value of the table has to be quoted
+bool _needs_quotes(const arrow::Table& table) {
+	for (const auto& column : table.columns()) {
+		if (column->type()->id() != arrow::Type::STRING) {
+			continue;
+		}
+		for (const auto& chunk : column->chunks()) {
+			const auto& strings = static_cast<const arrow::StringArray&>(*chunk);
+			for (auto row = 0; row < strings.length(); row++) {
+				if (strings.IsValid(row) && _needs_quotes(strings.GetView(row))) {
+					return true;
+				}
+			}
+		}
+	}
+	return false;
+}
+
+// Encodes a piece of a table as CSV, without header, in memory
+arrow::Result<shared_ptr<arrow::Buffer>> _encode_csv(const arrow::Table& table) {
+	bool quote_all = FLAGS_quoting == "all";
+	if (!quote_all && !_needs_quotes(table)) {
+		// Nothing to quote, Arrow's writer is faster
+		auto options = arrow::csv::WriteOptions::Defaults();
+		options.include_header = false;
+		options.quoting_style = arrow::csv::QuotingStyle::None;
+		ARROW_ASSIGN_OR_RAISE(auto buffer, arrow::io::BufferOutputStream::Create());
+		ARROW_RETURN_NOT_OK(arrow::csv::WriteCSV(table, options, buffer.get()));
+		return buffer->Finish();
+	}
+
+	// Arrow's Needed quoting quotes every string value, so the values are
+	// encoded one at a time, each quoted only if it has to be (or, with
+	// --quoting=all, every string value). Other columns (the keys) are
+	// never quoted.
+	vector<shared_ptr<arrow::StringArray>> columns;
+	vector<bool> quoted;
+	for (const auto& column : table.columns()) {
+		quoted.push_back(quote_all && column->type()->id() == arrow::Type::STRING);
+		ARROW_ASSIGN_OR_RAISE(auto strings, arrow::compute::Cast(column, arrow::utf8()));
+		ARROW_ASSIGN_OR_RAISE(auto array, arrow::Concatenate(strings.chunked_array()->chunks()));
+		columns.push_back(std::static_pointer_cast<arrow::StringArray>(array));
+	}
+	string csv;
+	for (int64_t row = 0; row < table.num_rows(); row++) {
+		for (size_t i = 0; i < columns.size(); i++) {
+			if (i > 0) {
+				csv += ',';
+			}
+			// Nulls are empty fields
+			if (columns[i]->IsValid(row)) {
+				_append_csv_field(csv, columns[i]->GetView(row), quoted[i]);
+			}
+		}
+		csv += '\n';
+	}
+	return arrow::Buffer::FromString(std::move(csv));
+}
+
 class CreateColumnGroupings : public VectorTestBase {
 public:
-	CreateColumnGroupings(RowVectorPtr t) {
+	CreateColumnGroupings(vector<RowVectorPtr> t) {
 		// Register Presto scalar functions.
 		functions::prestosql::registerAllScalarFunctions();
 
@@ -76,17 +464,41 @@ public:
 		// Table being split
 		this->_table = t;
 	}
+	// Streaming: the table is read batch by batch from the loader
+	CreateColumnGroupings(LoadCSVtoVelox* loader) : CreateColumnGroupings(vector<RowVectorPtr>()) {
+		this->_loader = loader;
+	}
 	~CreateColumnGroupings() {}
 	void compute(vector<vector<int64_t>>&, vector<int64_t>&);
+	// Reads the column groups (and their statistics) from a grouping.json
+	void load(string, map<string, string>&, vector<vector<int64_t>>&, vector<int64_t>&);
+	// Writes the column groups and the statistics they were computed from
+	// to grouping.json in the output directory
+	void save(map<string, string>&, vector<vector<int64_t>>&, vector<int64_t>&);
+	// The largest peak of the pools the statistics queries ran in, where
+	// their aggregation states live, plus the peak of the pool holding
+	// their results
+	int64_t peak_memory_bytes() {
+		return _query_peak_bytes + pool()->getMaxBytes();
+	}
 
 private:
-	RowVectorPtr _table;
+	// Statistics of every column, by compute() or load()
+	folly::dynamic _statistics = folly::dynamic::object;
+	int64_t _query_peak_bytes = 0;
+	RowVectorPtr _run(const core::PlanNodePtr&);
+	vector<RowVectorPtr> _table;
+	LoadCSVtoVelox* _loader = nullptr;
+	vector<string> _get_aggregates(const TypePtr&, bool);
+	RowVectorPtr _compute_statistics();
+	vector<RowVectorPtr> _sample(int64_t&);
+	RowVectorPtr _estimate_statistics();
 	void _get_sorted_col_order(vector<int64_t>&, vector<int64_t>&);
 };
 
 class Split : public VectorTestBase {
 public:
-	Split (RowVectorPtr t) {
+	Split (vector<RowVectorPtr> t) {
 		// Register Presto scalar functions.
 		functions::prestosql::registerAllScalarFunctions();
 
@@ -129,37 +541,68 @@ public:
 		return result[0];
 	}
 
-	std::shared_ptr<folly::Executor> executor_{
-			std::make_shared<folly::CPUThreadPoolExecutor>(
-					std::thread::hardware_concurrency())};
+	std::shared_ptr<folly::Executor> executor_{sharedExecutor()};
 	std::shared_ptr<core::QueryCtx> queryCtx_{
 			std::make_shared<core::QueryCtx>(executor_.get())};
 	std::unique_ptr<core::ExecCtx> execCtx_{
 			std::make_unique<core::ExecCtx>(pool_.get(), queryCtx_.get())};
 
+	// Streaming: the table is read batch by batch from the loader, and the
+	// fact table is handed to the store batch by batch
+	Split(LoadCSVtoVelox* loader) : Split(vector<RowVectorPtr>()) {
+		this->_loader = loader;
+	}
+
 	~Split() {}
 	void compute(vector<vector<int64_t>>&, vector<int64_t>&,
-		vector<RowVectorPtr>&, RowVectorPtr&, map<string, string>&);
+		vector<RowVectorPtr>&, vector<RowVectorPtr>&, map<string, string>&);
+	void compute(vector<vector<int64_t>>&, vector<int64_t>&,
+		vector<RowVectorPtr>&, StoreVeloxToCSV&, map<string, string>&);
+	int64_t peak_memory_bytes() {
+		return pool()->getMaxBytes();
+	}
 
 private:
-	RowVectorPtr _table;
+	vector<RowVectorPtr> _table;
+	LoadCSVtoVelox* _loader = nullptr;
+	size_t _next_batch_no = 0;
+
+	// Distinct column tuples of a column group seen so far, encoded by
+	// _append_to_key, with their keys. The dimension table is decoded from
+	// it once the input is split, so every tuple is stored once.
+	struct DimDictionary {
+		unordered_map<string, int64_t> keys;
+	};
+	void _append_to_key(string&, DecodedVector&, vector_size_t);
+	void _decode_key(const string&, vector<vector<optional<string>>>&);
+	RowVectorPtr _dim_table(DimDictionary&, int64_t, vector<string>&);
+	RowVectorPtr _encode(RowVectorPtr&, int64_t, vector<vector<int64_t>>&,
+		vector<int64_t>&, vector<DimDictionary>&);
+	RowVectorPtr _next_batch();
+	void _split(vector<vector<int64_t>>&, vector<RowVectorPtr>&,
+		map<string, string>&, std::function<void(RowVectorPtr&)>);
 };
 
-RowVectorPtr LoadCSVtoVelox::load(string filename, std::map<string, string> &col_name_mappings) {
-	// STEP 0: Load file to Velox via Arrow
-	// Load the file a first time
-	struct timespec startTime, endTime;
-	clock_gettime(CLOCK_MONOTONIC, &(startTime));
+arrow::csv::ReadOptions LoadCSVtoVelox::_read_options() {
+	// Parsing runs on Arrow's CPU thread pool, which main() sizes by arrowThreads()
+	auto read_options = arrow::csv::ReadOptions::Defaults();
+	read_options.use_threads = arrowThreads() > 1;
+	read_options.block_size = FLAGS_block_size;
+	return read_options;
+}
 
-	bool needs_reloading = false;
+shared_ptr<arrow::Table> LoadCSVtoVelox::_read_table(
+	string filename, const arrow::csv::ConvertOptions &convert_options) {
 	auto f = arrow::io::ReadableFile::Open(filename);
+	if (!f.ok()) {
+		cout << "ERROR opening file " << filename << endl;
+		exit(1);
+	}
 	shared_ptr<arrow::io::RandomAccessFile> input = f.ValueOrDie();
 
 	arrow::io::IOContext io_context = arrow::io::default_io_context();
-	
-	auto read_options = arrow::csv::ReadOptions::Defaults();
+	auto read_options = _read_options();
 	auto parse_options = arrow::csv::ParseOptions::Defaults();
-	auto convert_options = arrow::csv::ConvertOptions::Defaults();
 
 	// Instantiate TableReader from input stream and options
 	auto maybe_reader =
@@ -168,28 +611,57 @@ RowVectorPtr LoadCSVtoVelox::load(string filename, std::map<string, string> &col
 									read_options,
 									parse_options,
 									convert_options);
-
-	shared_ptr<arrow::csv::TableReader> reader = *maybe_reader;
 	if (!maybe_reader.ok()) {
 		cout << "ERROR initializing Arrow CSV reader" << endl;
 		exit(1);
 	}
+	shared_ptr<arrow::csv::TableReader> reader = *maybe_reader;
 	auto maybe_table = reader->Read();
 	if (!maybe_table.ok()) {
 		cout << "ERROR reading table into Arrow" << endl;
 		exit(2);
 	}
-	shared_ptr<arrow::Table> table = *maybe_table;
-	int i = 0;
-	auto col_names_from_csv = table->ColumnNames();
-	// Check if any of the columns are of tss type
-	for (const auto& column: table->columns()) {
-		shared_ptr<arrow::Array> chunk = column->chunk(0);
-		ArrowArray array;
-		ArrowSchema schema;
-		arrow::ExportArray(*chunk, &array, &schema);
-		// // cout << "Column name: " << col_names_from_csv[i] << " Format type: " << schema.format << endl;
+	return *maybe_table;
+}
+
+shared_ptr<arrow::Schema> LoadCSVtoVelox::_read_schema(string filename) {
+	if (FLAGS_sniff_bytes == 0) {
+		// Infer the types from the whole file
+		return _read_table(filename, arrow::csv::ConvertOptions::Defaults())->schema();
+	}
+
+	// Only the first block of the file is parsed to infer the schema
+	auto f = arrow::io::ReadableFile::Open(filename);
+	if (!f.ok()) {
+		cout << "ERROR opening file " << filename << endl;
+		exit(1);
+	}
+	shared_ptr<arrow::io::InputStream> input = f.ValueOrDie();
+
+	auto read_options = arrow::csv::ReadOptions::Defaults();
+	read_options.use_threads = false;
+	read_options.block_size = FLAGS_sniff_bytes;
+	auto maybe_reader =
+	arrow::csv::StreamingReader::Make(arrow::io::default_io_context(),
+										input,
+										read_options,
+										arrow::csv::ParseOptions::Defaults(),
+										arrow::csv::ConvertOptions::Defaults());
+	if (!maybe_reader.ok()) {
+		cout << "ERROR initializing Arrow CSV reader" << endl;
+		exit(1);
+	}
+	auto schema = (*maybe_reader)->schema();
+	(*maybe_reader)->Close();
+	return schema;
+}
 
+arrow::csv::ConvertOptions LoadCSVtoVelox::_string_convert_options(string filename) {
+	// Learn the column names and check for binary columns on a prefix of the file
+	auto convert_options = arrow::csv::ConvertOptions::Defaults();
+	auto csv_schema = _read_schema(filename);
+	_inferred_schema = csv_schema;
+	for (const auto& field : csv_schema->fields()) {
 		// Arrow CSV loader loads into the following datatypes (see CDataInterfact.rst)
 		// n : null
 		// l : int64
@@ -201,81 +673,36 @@ RowVectorPtr LoadCSVtoVelox::load(string filename, std::map<string, string> &col
 		// tss: : timestamp[s]
 		// tsn: : timestamp[ns]
 		// We want to parse all the types as strings
-		// First character of schema format string
-		char schema_format = string(schema.format)[0];
-		if (schema_format == 'z' || schema_format == 'Z') {
-			cout << "ERROR: Binary column " << col_names_from_csv[i] <<
+		auto type_id = field->type()->id();
+		if (type_id == arrow::Type::BINARY || type_id == arrow::Type::LARGE_BINARY) {
+			cout << "ERROR: Binary column " << field->name() <<
 				" in data, not currently supported" << endl;
 			exit(1);
-		} else {
-			// everything else is a string
-			convert_options.column_types[col_names_from_csv[i]] = ::arrow::utf8();
-			needs_reloading = true;
-		}
-		i += 1;
-	}
-	// // cout << endl;
-
-	if (needs_reloading) {
-		// Read the whole file when reading a second time
-		f = arrow::io::ReadableFile::Open(filename);
-		input = f.ValueOrDie();
-		io_context = arrow::io::default_io_context();
-		read_options = arrow::csv::ReadOptions::Defaults();
-		maybe_reader =
-		arrow::csv::TableReader::Make(io_context,
-										input,
-										read_options,
-										parse_options,
-										convert_options);
-
-		reader = *maybe_reader;
-		if (!maybe_reader.ok()) {
-			cout << "ERROR initializing Arrow CSV reader" << endl;
-			exit(1);
-		}
-		maybe_table = reader->Read();
-		if (!maybe_table.ok()) {
-			cout << "ERROR reading table into Arrow" << endl;
-			exit(2);
 		}
-		table = *maybe_table;
+		// everything else is a string
+		convert_options.column_types[field->name()] = ::arrow::utf8();
 	}
-	shared_ptr<arrow::Table> combined = table->CombineChunks().ValueOrDie();
-
-	clock_gettime(CLOCK_MONOTONIC, &(endTime));
-	auto timeDiff = getTimeDiff(startTime, endTime);
-	// cout << "Time for loading CSV into Arrow: " << timeDiff << " ns" << endl;
-	clock_gettime(CLOCK_MONOTONIC, &(startTime));
+	return convert_options;
+}
 
-	// Convert arrow::Table to velox vectors
-	// Have to convert each individual array (column) in the table
-	// to a velox vector, and convert the collection of vectors into a velox table
+RowVectorPtr LoadCSVtoVelox::_import(const vector<shared_ptr<arrow::Array>> &arrays) {
+	// Convert arrow::Arrays to velox vectors
+	// Have to convert each individual array (column) to a velox vector,
+	// and convert the collection of vectors into a velox table
 	vector<VectorPtr> velox_vectors;
 	vector<string> col_names;
 	int c = 0;
-	i = 0;
-	col_names_from_csv = combined->ColumnNames();
-	for (const auto& column : combined->columns()) {
-		// Ensure that there is only one chunk per column
-		if (column->num_chunks() > 1) {
-			// cout << "More than one chunk: " << column->num_chunks() << endl;
-		}
-
+	for (const auto& arrow_array : arrays) {
 		// Convert arrow::Array to ArrowArray type defined in Arrow ABI
 		ArrowArray array;
 		ArrowSchema schema;
-		shared_ptr<arrow::Array> chunk = column->chunk(0);
-		arrow::ExportArray(*chunk, &array, &schema);
-		// cout << "Column name: " << col_names_from_csv[i] << " Format type: " << schema.format << endl;
+		arrow::ExportArray(*arrow_array, &array, &schema);
 
 		// Import ArrowArray to Velox BaseVector
 		auto velox_vector = importFromArrowAsOwner(schema, array, pool());
 		velox_vectors.push_back(velox_vector);
 		col_names.push_back(string("c") + to_string(c));
-		col_name_mappings[string("c") + to_string(c)] = col_names_from_csv[i];
 		c += 1;
-		i += 1;
 
 		// Release Arrow memory -- throwing SEG_FAULT
 		// array.release(&array);
@@ -283,21 +710,104 @@ RowVectorPtr LoadCSVtoVelox::load(string filename, std::map<string, string> &col
 	}
 
 	// Convert the vector of facebook::velox::BaseVector to a velox table
-	auto velox_table = makeRowVector(col_names, velox_vectors);
-	auto num_rows = velox_table->size();
-	auto num_cols = velox_table->children().size();
-	// cout << "Number of rows: " << num_rows << endl;
-	// cout << "Number of columns: " << num_cols << endl;
-	// auto types = velox_table->type();
-	// cout << "Types: " << endl;
-	// for (int i=0; i<num_cols; i++) {
-	// 	cout << "Column name: " << col_names_from_csv[i] << ":" << types->childAt(i)->toString() << endl;
-	// }
+	return makeRowVector(col_names, velox_vectors);
+}
+
+vector<RowVectorPtr> LoadCSVtoVelox::load(string filename, std::map<string, string> &col_name_mappings) {
+	// STEP 0: Load file to Velox via Arrow
+	struct timespec startTime, endTime;
+	clock_gettime(CLOCK_MONOTONIC, &(startTime));
+
+	// Parse the whole file exactly once, with every column as a string
+	shared_ptr<arrow::Table> table = _read_table(filename, _string_convert_options(filename));
+
+	clock_gettime(CLOCK_MONOTONIC, &(endTime));
+	auto timeDiff = getTimeDiff(startTime, endTime);
+	csv_to_arrow_time_ns += timeDiff;
+	num_rows = table->num_rows();
+	clock_gettime(CLOCK_MONOTONIC, &(startTime));
+
+	int i = 0;
+	for (const auto& col_name : table->ColumnNames()) {
+		col_name_mappings[string("c") + to_string(i)] = col_name;
+		i += 1;
+	}
+
+	// Keep Arrow's chunking: every record batch of the table is imported
+	// as its own velox table, without copying the buffers
+	vector<RowVectorPtr> velox_batches;
+	arrow::TableBatchReader batch_reader(*table);
+	shared_ptr<arrow::RecordBatch> batch;
+	while (true) {
+		if (!batch_reader.ReadNext(&batch).ok()) {
+			cout << "ERROR reading record batch from Arrow table" << endl;
+			exit(2);
+		}
+		if (batch == nullptr) {
+			break;
+		}
+		velox_batches.push_back(_import(batch->columns()));
+	}
 
 	clock_gettime(CLOCK_MONOTONIC, &(endTime));
 	timeDiff = getTimeDiff(startTime, endTime);
-	// cout << "Time for porting from Arrow to Velox: " << timeDiff << " ns" << endl;
-	return velox_table;
+	arrow_to_velox_time_ns += timeDiff;
+	return velox_batches;
+}
+
+void LoadCSVtoVelox::open(string filename, std::map<string, string> &col_name_mappings) {
+	num_rows = 0;
+	auto convert_options = _string_convert_options(filename);
+
+	auto f = arrow::io::ReadableFile::Open(filename);
+	if (!f.ok()) {
+		cout << "ERROR opening file " << filename << endl;
+		exit(1);
+	}
+	shared_ptr<arrow::io::InputStream> input = f.ValueOrDie();
+
+	auto maybe_reader =
+	arrow::csv::StreamingReader::Make(arrow::io::default_io_context(),
+										input,
+										_read_options(),
+										arrow::csv::ParseOptions::Defaults(),
+										convert_options);
+	if (!maybe_reader.ok()) {
+		cout << "ERROR initializing Arrow CSV reader" << endl;
+		exit(1);
+	}
+	_reader = *maybe_reader;
+
+	int i = 0;
+	for (const auto& field : _reader->schema()->fields()) {
+		col_name_mappings[string("c") + to_string(i)] = field->name();
+		i += 1;
+	}
+}
+
+RowVectorPtr LoadCSVtoVelox::next() {
+	struct timespec startTime, endTime;
+	clock_gettime(CLOCK_MONOTONIC, &(startTime));
+
+	shared_ptr<arrow::RecordBatch> batch;
+	if (!_reader->ReadNext(&batch).ok()) {
+		cout << "ERROR reading record batch into Arrow" << endl;
+		exit(2);
+	}
+	if (batch == nullptr) {
+		return nullptr;
+	}
+
+	clock_gettime(CLOCK_MONOTONIC, &(endTime));
+	csv_to_arrow_time_ns += getTimeDiff(startTime, endTime);
+	startTime = endTime;
+
+	num_rows += batch->num_rows();
+	auto velox_batch = _import(batch->columns());
+
+	clock_gettime(CLOCK_MONOTONIC, &(endTime));
+	arrow_to_velox_time_ns += getTimeDiff(startTime, endTime);
+	return velox_batch;
 }
 
 void CreateColumnGroupings::_get_sorted_col_order(
@@ -332,79 +842,372 @@ void CreateColumnGroupings::_get_sorted_col_order(
 	}
 }
 
-void CreateColumnGroupings::compute(
-	vector<vector<int64_t>> &col_groups, vector<int64_t> &fact) {
-	// STEP 1:
-	// Perform Approximate COUNT DISTINCT and measure the TOTAL SIZE in bytes
-	int num_cols = _table->children().size();
-	int num_rows = 0;
-	vector<int64_t> approx_counts;
-	vector<int64_t> total_sizes;
-	vector<int64_t> max_sizes;
-	vector<int64_t> sorted_order;
+vector<string> CreateColumnGroupings::_get_aggregates(const TypePtr& row_type, bool merge) {
+	// With merge set, the aggregates combine the intermediate results of
+	// partial aggregations, which carry the same names as the final results
+	auto num_cols = row_type->size();
+	auto input = [&](string prefix, int i) {
+		return merge ? prefix + to_string(i) : string("c") + to_string(i);
+	};
 
 	vector<string> aggregates;
-	aggregates.push_back("count(*)");
+	aggregates.push_back(merge ? "count(num_rows) as num_rows" : "count(*) as num_rows");
 	for (int i=0; i<num_cols; i++) {
-		auto col = _table->childAt(i);
-		if (col->typeKind() == TypeKind::VARBINARY) {
+		if (row_type->childAt(i)->kind() == TypeKind::VARBINARY) {
 			aggregates.push_back(
-				string("count(c") +
-				to_string(i) +
+				string("count(") +
+				input("ad", i) +
 				string(") as ad") +
 				to_string(i));
 		} else {
 			aggregates.push_back(
-				string("approx_distinct(c") +
-				to_string(i) +
+				string("approx_distinct(") +
+				input("ad", i) +
 				string(") as ad") +
 				to_string(i));
 		}
 	}
 	for (int i=0; i<num_cols; i++) {
 		aggregates.push_back(
-			string("total_size(c") +
-			to_string(i) +
+			string("total_size(") +
+			input("ts", i) +
 			string(") as ts") +
 			to_string(i));
 	}
 	for (int i=0; i<num_cols; i++) {
 		aggregates.push_back(
-			string("max_data_size_for_stats(c") +
-			to_string(i) +
-			string(") as ts") +
+			string("max_data_size_for_stats(") +
+			input("ms", i) +
+			string(") as ms") +
 			to_string(i));
 	}
+	return aggregates;
+}
+
+RowVectorPtr CreateColumnGroupings::_run(const core::PlanNodePtr &plan) {
+	// Every query runs in its own QueryCtx, whose pool holds its allocations
+	auto query_ctx = newQueryCtx();
+	auto results = AssertQueryBuilder(plan).queryCtx(query_ctx).copyResults(pool());
+	_query_peak_bytes = std::max(_query_peak_bytes, query_ctx->pool()->getMaxBytes());
+	return results;
+}
+
+RowVectorPtr CreateColumnGroupings::_compute_statistics() {
+	if (_loader == nullptr) {
+		auto plan = PlanBuilder()
+						.values(_table)
+						.singleAggregation(
+							{},
+							_get_aggregates(_table[0]->type(), false))
+						.planNode();
+		return _run(plan);
+	}
+
+	// Streaming: run a partial aggregation on every batch as it is read,
+	// and merge the (single row) intermediate results at the end
+	vector<RowVectorPtr> partials;
+	TypePtr row_type;
+	while (auto batch = _loader->next()) {
+		row_type = batch->type();
+		auto plan = PlanBuilder()
+						.values({batch})
+						.partialAggregation(
+							{},
+							_get_aggregates(row_type, false))
+						.planNode();
+		partials.push_back(_run(plan));
+	}
+	if (partials.empty()) {
+		cout << "ERROR: no rows in CSV file" << endl;
+		exit(2);
+	}
+
+	auto aggregates = _get_aggregates(row_type, true);
+	vector<TypePtr> result_types(aggregates.size(), BIGINT());
 	auto plan = PlanBuilder()
-					.values({_table})
+					.values(partials)
+					.finalAggregation(
+						{},
+						aggregates,
+						result_types)
+					.planNode();
+	return _run(plan);
+}
+
+vector<RowVectorPtr> CreateColumnGroupings::_sample(int64_t &total_rows) {
+	// Fixed seed, so that a file is always split the same way
+	std::mt19937_64 rng(0);
+	std::uniform_real_distribution<double> uniform(0, 1);
+	vector<RowVectorPtr> sample;
+	total_rows = 0;
+
+	if (_loader == nullptr) {
+		// Uniform sample of the rows, wrapped in dictionaries over the batches
+		for (auto batch : _table) {
+			total_rows += batch->size();
+		}
+		double fraction = FLAGS_sample_rows > 0 ?
+			double(FLAGS_sample_rows) / total_rows : FLAGS_sample_fraction;
+		if (fraction >= 1) {
+			return _table;
+		}
+		for (auto batch : _table) {
+			vector<vector_size_t> rows;
+			for (vector_size_t row = 0; row < batch->size(); row++) {
+				if (uniform(rng) < fraction) {
+					rows.push_back(row);
+				}
+			}
+			if (rows.empty()) {
+				continue;
+			}
+			auto indices = makeIndices(rows);
+			vector<VectorPtr> cols;
+			for (auto child : batch->children()) {
+				cols.push_back(BaseVector::wrapInDictionary(nullptr, indices, rows.size(), child));
+			}
+			sample.push_back(makeRowVector(batch->type()->asRow().names(), cols));
+		}
+		if (sample.empty()) {
+			return _table;
+		}
+		return sample;
+	}
+
+	// Streaming: the batches are gone once read, so sample whole batches.
+	// With --sample_rows keep a reservoir of batches holding about that many
+	// rows, otherwise keep every batch with probability --sample_fraction.
+	RowVectorPtr first_batch;
+	int64_t num_batches = 0;
+	size_t capacity = 0;
+	while (auto batch = _loader->next()) {
+		if (first_batch == nullptr) {
+			first_batch = batch;
+			capacity = std::max<int64_t>(1, (FLAGS_sample_rows + batch->size() - 1) / batch->size());
+		}
+		total_rows += batch->size();
+		num_batches += 1;
+		if (FLAGS_sample_rows > 0) {
+			if (sample.size() < capacity) {
+				sample.push_back(batch);
+			} else {
+				auto slot = std::uniform_int_distribution<int64_t>(0, num_batches - 1)(rng);
+				if (slot < capacity) {
+					sample[slot] = batch;
+				}
+			}
+		} else if (uniform(rng) < FLAGS_sample_fraction) {
+			sample.push_back(batch);
+		}
+	}
+	if (sample.empty() && first_batch != nullptr) {
+		sample.push_back(first_batch);
+	}
+	return sample;
+}
+
+RowVectorPtr CreateColumnGroupings::_estimate_statistics() {
+	int64_t total_rows;
+	auto sample = _sample(total_rows);
+	if (sample.empty()) {
+		cout << "ERROR: no rows in CSV file" << endl;
+		exit(2);
+	}
+	auto row_type = sample[0]->type();
+	int num_cols = row_type->size();
+
+	// Sizes on the sample, scaled up to the whole table
+	auto plan = PlanBuilder()
+					.values(sample)
 					.singleAggregation(
 						{},
-						aggregates)
+						_get_aggregates(row_type, false))
 					.planNode();
+	auto sample_results = _run(plan);
+	auto value = [&](int i) {
+		return stoll(sample_results->childAt(i)->toString(0));
+	};
+	int64_t sample_size = value(0);
+	double scale = double(total_rows) / sample_size;
+
+	vector<int64_t> approx_counts;
+	vector<int64_t> total_sizes;
+	vector<int64_t> max_sizes;
+	for (int i=0; i<num_cols; i++) {
+		total_sizes.push_back(llround(value(num_cols+i+1) * scale));
+		// A maximum cannot be scaled up, the sample maximum is the estimate
+		max_sizes.push_back(value(2*num_cols+i+1));
+
+		if (row_type->childAt(i)->kind() == TypeKind::VARBINARY) {
+			// Binary columns are counted rather than counted distinct
+			approx_counts.push_back(llround(value(i+1) * scale));
+			continue;
+		}
+
+		// Number of distinct values d in the sample, and the number f1 of them
+		// that occur exactly once
+		string col_name = string("c") + to_string(i);
+		plan = PlanBuilder()
+				.values(sample)
+				.singleAggregation({col_name}, {"count(*) as cnt"})
+				.project({"cnt = 1 as singleton"})
+				.singleAggregation({}, {"count(*) as d", "count_if(singleton) as f1"})
+				.planNode();
+		auto freqs = _run(plan);
+		int64_t d = stoll(freqs->childAt(0)->toString(0));
+		int64_t f1 = stoll(freqs->childAt(1)->toString(0));
+
+		// GEE estimator (Charikar et al., "Towards estimation error guarantees
+		// for distinct values"): every value seen once in the sample stands
+		// for sqrt(N/n) values of the table, values seen more often are
+		// assumed to have been fully discovered
+		double ndv = sqrt(scale) * f1 + (d - f1);
+		ndv = std::min<double>(std::max<double>(ndv, d), total_rows);
+		approx_counts.push_back(llround(ndv));
+	}
+
+	// Same layout as the result of _compute_statistics
+	vector<VectorPtr> cols;
+	cols.push_back(makeFlatVector<int64_t>(vector<int64_t>{total_rows}));
+	for (auto stats : {&approx_counts, &total_sizes, &max_sizes}) {
+		for (auto stat : *stats) {
+			cols.push_back(makeFlatVector<int64_t>(vector<int64_t>{stat}));
+		}
+	}
+	return makeRowVector(cols);
+}
+
+void CreateColumnGroupings::save(
+	map<string, string> &col_name_mappings, vector<vector<int64_t>> &col_groups, vector<int64_t> &fact) {
+	auto columns = folly::dynamic::array();
+	for (auto i = 0; i < col_name_mappings.size(); i++) {
+		columns.push_back(col_name_mappings[string("c") + to_string(i)]);
+	}
+	auto groups = folly::dynamic::array();
+	for (const auto& col_group : col_groups) {
+		groups.push_back(folly::dynamic(col_group.begin(), col_group.end()));
+	}
+	folly::dynamic grouping = folly::dynamic::object
+		("version", splitCsvVersion)
+		// Columns are referred to by their position in this list
+		("columns", columns)
+		("column_groups", groups)
+		("fact", folly::dynamic(fact.begin(), fact.end()))
+		("statistics", _statistics);
+
+	auto path = std::filesystem::path(FLAGS_output_dir) / (FLAGS_output_prefix + "grouping.json");
+	std::ofstream out(path);
+	out << folly::toPrettyJson(grouping) << endl;
+	if (!out) {
+		cout << "ERROR writing " << path.string() << endl;
+		exit(3);
+	}
+}
+
+void CreateColumnGroupings::load(string filename, map<string, string> &col_name_mappings,
+	vector<vector<int64_t>> &col_groups, vector<int64_t> &fact) {
+	std::ifstream in(filename);
+	std::stringstream contents;
+	contents << in.rdbuf();
+	if (!in) {
+		cout << "ERROR reading " << filename << endl;
+		exit(1);
+	}
+	folly::dynamic grouping;
+	try {
+		grouping = folly::parseJson(contents.str());
+	} catch (const std::exception& e) {
+		cout << "ERROR parsing " << filename << ": " << e.what() << endl;
+		exit(1);
+	}
+
+	// A missing field or a value of the wrong type throws
+	try {
+		// The grouping only applies to a file with the same columns
+		const auto& columns = grouping["columns"];
+		bool same_columns = columns.size() == col_name_mappings.size();
+		for (auto i = 0; same_columns && i < columns.size(); i++) {
+			same_columns = columns[i].asString() == col_name_mappings[string("c") + to_string(i)];
+		}
+		if (!same_columns) {
+			cout << "ERROR: the columns of the CSV file do not match " << filename << endl;
+			exit(1);
+		}
+
+		// Every column is in at most one group or in the fact table
+		int64_t num_columns = col_name_mappings.size();
+		vector<bool> seen(num_columns, false);
+		auto check_column = [&](const folly::dynamic& col_id) {
+			if (!col_id.isInt() || col_id.asInt() < 0 || col_id.asInt() >= num_columns) {
+				cout << "ERROR: invalid column " << folly::toJson(col_id) << " in " << filename << endl;
+				exit(1);
+			}
+			if (seen[col_id.asInt()]) {
+				cout << "ERROR: column " << col_id.asInt() << " appears twice in " << filename << endl;
+				exit(1);
+			}
+			seen[col_id.asInt()] = true;
+			return col_id.asInt();
+		};
+		for (const auto& group : grouping["column_groups"]) {
+			col_groups.emplace_back();
+			for (const auto& col_id : group) {
+				col_groups.back().push_back(check_column(col_id));
+			}
+		}
+		for (const auto& col_id : grouping["fact"]) {
+			fact.push_back(check_column(col_id));
+		}
+		_statistics = grouping["statistics"];
+	} catch (const std::exception& e) {
+		cout << "ERROR: invalid grouping in " << filename << ": " << e.what() << endl;
+		exit(1);
+	}
+}
+
+void CreateColumnGroupings::compute(
+	vector<vector<int64_t>> &col_groups, vector<int64_t> &fact) {
+	// STEP 1:
+	// Perform Approximate COUNT DISTINCT and measure the TOTAL SIZE in bytes
+	vector<int64_t> approx_counts;
+	vector<int64_t> total_sizes;
+	vector<int64_t> max_sizes;
+	vector<int64_t> sorted_order;
 
 	// Collect results -- number of rows, approx count distinct, and total sizes of each column
-	auto results = AssertQueryBuilder(plan).copyResults(pool());
-	num_rows = stoi(results->childAt(0)->toString(0));
+	bool sampling = FLAGS_sample_rows > 0 || FLAGS_sample_fraction > 0;
+	auto results = sampling ? _estimate_statistics() : _compute_statistics();
+	int num_cols = (results->childrenSize() - 1) / 3;
+	int64_t num_rows = stoll(results->childAt(0)->toString(0));
 	// cout << "Total no. of rows: " << num_rows << endl;
 
 	// cout << endl << "Approx. count distinct:" << endl;
 	for (int i=0; i<num_cols; i++) {
-		approx_counts.push_back(stoi(results->childAt(i+1)->toString(0)));
+		approx_counts.push_back(stoll(results->childAt(i+1)->toString(0)));
 		// cout << "Column " << i << ": " << approx_counts.back() << endl;
 	}
 
 	// cout << endl << "Total size:" << endl;
 	for (int i=0; i<num_cols; i++) {
-		total_sizes.push_back(stoi(results->childAt(num_cols+i+1)->toString(0)));
+		total_sizes.push_back(stoll(results->childAt(num_cols+i+1)->toString(0)));
 		// cout << "Column " << i << ": " << total_sizes.back() << endl;
 	}
 
 	// cout << endl << "Max size:" << endl;
 	for (int i=0; i<num_cols; i++) {
-		max_sizes.push_back(stoi(results->childAt(2*num_cols+i+1)->toString(0)));
+		max_sizes.push_back(stoll(results->childAt(2*num_cols+i+1)->toString(0)));
 		// cout << "Column " << i << ": " << max_sizes.back() << endl;
 	}
 
+	_statistics = folly::dynamic::object("num_rows", num_rows)("sampled", sampling);
+	_statistics["columns"] = folly::dynamic::array();
+	for (int i=0; i<num_cols; i++) {
+		_statistics["columns"].push_back(folly::dynamic::object
+			("approx_distinct", approx_counts[i])
+			("total_size", total_sizes[i])
+			("max_size", max_sizes[i]));
+	}
+
 	// STEP 2: Sort columns by approx counts
 	_get_sorted_col_order(approx_counts, sorted_order);
 	// cout << endl << "Sorted order: ";
@@ -436,8 +1239,8 @@ void CreateColumnGroupings::compute(
 			estimated_tuple_size += max_sizes[col_id];
 			actual_space += total_sizes[col_id];
 		}
-		// 8-byte keys
-		estimated_space = estimated_cardinality*estimated_tuple_size + (num_rows+estimated_cardinality)*8;
+		estimated_space = estimated_cardinality*estimated_tuple_size +
+			(num_rows+estimated_cardinality)*keyWidth(estimated_cardinality);
 		if (estimated_space < actual_space) {
 			col_group.push_back(sorted_order[i]);
 		} else {
@@ -449,7 +1252,8 @@ void CreateColumnGroupings::compute(
 				estimated_cardinality = approx_counts[col_id];
 				estimated_tuple_size = float(total_sizes[col_id])/num_rows;
 				actual_space = total_sizes[col_id];
-				estimated_space = estimated_cardinality*estimated_tuple_size + (num_rows+estimated_cardinality)*8;
+				estimated_space = estimated_cardinality*estimated_tuple_size +
+					(num_rows+estimated_cardinality)*keyWidth(estimated_cardinality);
 				if (estimated_space < actual_space) {
 					col_groups.push_back(temp);
 				} else {
@@ -470,7 +1274,8 @@ void CreateColumnGroupings::compute(
 		estimated_cardinality = approx_counts[col_id];
 		estimated_tuple_size = float(total_sizes[col_id])/num_rows;
 		actual_space = total_sizes[col_id];
-		estimated_space = estimated_cardinality*estimated_tuple_size + (num_rows+estimated_cardinality)*8;
+		estimated_space = estimated_cardinality*estimated_tuple_size +
+			(num_rows+estimated_cardinality)*keyWidth(estimated_cardinality);
 		if (estimated_space < actual_space) {
 			col_groups.push_back(col_group);
 		} else {
@@ -493,222 +1298,796 @@ void CreateColumnGroupings::compute(
 	// cout << endl;
 }
 
-// USES WINDOW FUNCTION AND AGGREGATION
-void Split::compute(
-	vector<vector<int64_t>> &col_groups, vector<int64_t> &fact,
-	vector<RowVectorPtr> &dim_tables, RowVectorPtr &fact_table,
-	map<string, string> &col_name_mappings) {
-	// STEP 4: Split the table into star schema
+void Split::_append_to_key(string &key, DecodedVector &decoded, vector_size_t row) {
+	// Length-prefixed so that tuples of different values never collide
+	if (decoded.isNullAt(row)) {
+		key.push_back('\0');
+		return;
+	}
+	auto value = decoded.valueAt<StringView>(row);
+	uint32_t size = value.size();
+	key.push_back('\1');
+	key.append(reinterpret_cast<const char*>(&size), sizeof(size));
+	key.append(value.data(), size);
+}
 
-	// Local variables
-	RowVectorPtr fact_table_local;
-	vector<RowVectorPtr> dim_tables_local;
-	vector<vector<string>> col_groups_names;
-	vector<vector<string>> orig_names_dims;
-	vector<string> orig_names_fact;
-	for (auto col_group : col_groups) {
-		vector<string> col_names;
-		for (auto col_no : col_group) {
-			string col_name = string("c") + to_string(col_no);
-			col_names.push_back(col_name);
-		}
-		col_groups_names.push_back(col_names);
-	}
-
-	// Iterate over all the col groups to generate dimension tables and fact table
-	auto group_no = 0;
-	fact_table_local = _table;
-
-	// Fact table col names are updated as we update the fact table
-	vector<string> fact_table_col_names;
-	auto num_cols = fact_table_local->children().size();
-	for (auto i=0; i<num_cols; i++) {
-		fact_table_col_names.push_back(string("c") + to_string(i));
-	}
-	for (auto dim_col_names : col_groups_names) {
-		// Add a column to the fact table
-		vector<int64_t> keys;
-		auto num_rows = fact_table_local->size();
-		for (auto i=0; i<num_rows; i++) {
-			keys.push_back(i);
-		}
-		auto key_col = makeFlatVector<int64_t>(keys);
-		vector<VectorPtr> cols;
-		for (auto col : fact_table_local->children()) {
-			cols.push_back(col);
-		}
-		cols.push_back(key_col);
-		vector<string> temp_table_col_names(fact_table_col_names);
-		temp_table_col_names.push_back("key");
-		auto temp_table = makeRowVector(temp_table_col_names, cols);
-
-		// Generate the dimension table
-		string aggregate = "min(key) as p" + to_string(group_no);
-		auto plan = PlanBuilder()
-					.values({temp_table})
-					.aggregation(
-						dim_col_names,
-						{aggregate},
-						{},
-						core::AggregationNode::Step::kPartial,
-						false)
-					.planNode();
-		auto results = AssertQueryBuilder(plan).copyResults(pool());
-		// // cout << results->toString() << endl;
-		// // cout << results->toString(1, 10) << endl << endl;
+void Split::_decode_key(const string &key, vector<vector<optional<string>>> &values) {
+	size_t pos = 0;
+	for (auto &column : values) {
+		if (key[pos++] == '\0') {
+			column.push_back(nullopt);
+			continue;
+		}
+		uint32_t size;
+		memcpy(&size, key.data() + pos, sizeof(size));
+		pos += sizeof(size);
+		column.push_back(key.substr(pos, size));
+		pos += size;
+	}
+}
 
-		// Keep track of original names of the columns in the dimension table
-		// for reassigning the original names at the end
-		vector<string> orig_names_dim;
-		for (auto col_name : dim_col_names) {
-			orig_names_dim.push_back(col_name_mappings[col_name]);
-		}
-		orig_names_dim.push_back(string("p") + to_string(group_no));
-		orig_names_dims.push_back(orig_names_dim);
-		// // cout << results->toString(1, 10) << endl << endl;
-		dim_tables_local.push_back(results);
-
-		// Generate the fact table
-
-		// Generate the window clause
-		string window_clause = string("min(key) OVER (PARTITION BY ");
-		auto j = 0;
-		for (auto dim_col_name : dim_col_names) {
-			if (j != 0) window_clause += string(", ");
-			window_clause += dim_col_name;
-			j += 1;
-		}
-		window_clause += " ROWS BETWEEN UNBOUNDED PRECEDING AND UNBOUNDED FOLLOWING) as p" + to_string(group_no);
-
-		// Generate the fact table column names to be projected out
-		vector<string> project_col_names;
-		for (auto col_name : fact_table_col_names) {
-			if (find(dim_col_names.begin(), dim_col_names.end(), col_name) != dim_col_names.end())
-				// A dimension column
-				continue;
-			project_col_names.push_back(col_name);
+RowVectorPtr Split::_dim_table(DimDictionary &dim, int64_t group_no, vector<string> &names) {
+	// The rows are in the order of their keys, which is the order in which
+	// the tuples were first seen
+	using Entry = unordered_map<string, int64_t>::iterator;
+	vector<pair<int64_t, Entry>> entries;
+	entries.reserve(dim.keys.size());
+	for (auto it = dim.keys.begin(); it != dim.keys.end(); it++) {
+		entries.push_back({it->second, it});
+	}
+	std::sort(entries.begin(), entries.end(),
+		[](const auto &a, const auto &b) { return a.first < b.first; });
+
+	// Each tuple is dropped from the dictionary once it is decoded
+	vector<vector<optional<string>>> values(names.size());
+	vector<int64_t> dim_keys;
+	dim_keys.reserve(entries.size());
+	for (auto &[key, it] : entries) {
+		_decode_key(it->first, values);
+		dim_keys.push_back(key);
+		dim.keys.erase(it);
+	}
+
+	vector<VectorPtr> cols;
+	for (auto &column : values) {
+		cols.push_back(makeNullableFlatVector<std::string>(column));
+	}
+	cols.push_back(makeFlatVector<int64_t>(dim_keys));
+	vector<string> names_with_key = names;
+	names_with_key.push_back(string("p") + to_string(group_no));
+	return makeRowVector(names_with_key, cols);
+}
+
+RowVectorPtr Split::_encode(
+	RowVectorPtr &batch, int64_t first_row, vector<vector<int64_t>> &col_groups,
+	vector<int64_t> &fact_col_ids, vector<DimDictionary> &dims) {
+	auto num_rows = batch->size();
+	vector<VectorPtr> fact_cols;
+	for (auto col_id : fact_col_ids) {
+		fact_cols.push_back(batch->childAt(col_id));
+	}
+
+	// The groups have their own dictionaries, so they are encoded
+	// concurrently on the executor. Velox vectors are only created once all
+	// the groups are done.
+	vector<vector<int64_t>> group_keys(col_groups.size());
+	auto encode_group = [&](int group_no) {
+		string key;
+		auto &dim = dims[group_no];
+		auto &col_group = col_groups[group_no];
+		vector<DecodedVector> decoded;
+		decoded.reserve(col_group.size());
+		for (auto col_id : col_group) {
+			decoded.emplace_back(*batch->childAt(col_id));
 		}
-		project_col_names.push_back(string("p") + to_string(group_no));
-		fact_table_col_names = project_col_names;
 
-		plan = PlanBuilder()
-				.values({temp_table})
-				.window({window_clause})
-				.project(fact_table_col_names)
-				.planNode();
-		fact_table_local = AssertQueryBuilder(plan).copyResults(pool());
-		temp_table = nullptr;
+		// The key of a tuple is the row number of its first occurrence (the
+		// same as min(row number) over the tuple), or with --dense_keys the
+		// number of tuples seen before it
+		auto &keys = group_keys[group_no];
+		keys.resize(num_rows);
+		for (vector_size_t row = 0; row < num_rows; row++) {
+			key.clear();
+			for (auto &d : decoded) {
+				_append_to_key(key, d, row);
+			}
+			int64_t new_key = FLAGS_dense_keys ? dim.keys.size() : first_row + row;
+			// try_emplace only copies the key when the tuple is new
+			keys[row] = dim.keys.try_emplace(key, new_key).first->second;
+		}
+	};
+
+	if (col_groups.size() > 1 && veloxThreads() > 1) {
+		vector<folly::Future<folly::Unit>> futures;
+		for (auto group_no = 0; group_no < col_groups.size(); group_no++) {
+			futures.push_back(folly::via(executor_.get(), [&, group_no]() {
+				encode_group(group_no);
+			}));
+		}
+		// value() rethrows the exception of a failed group
+		for (auto &result : folly::collectAll(std::move(futures)).get()) {
+			result.value();
+		}
+	} else {
+		for (auto group_no = 0; group_no < col_groups.size(); group_no++) {
+			encode_group(group_no);
+		}
+	}
 
-		group_no++;
+	for (auto &keys : group_keys) {
+		fact_cols.push_back(makeFlatVector<int64_t>(keys));
 	}
+	return makeRowVector(fact_cols);
+}
 
-	for (auto col_name : fact_table_col_names) {
-		if (col_name[0] == 'p') {
-			orig_names_fact.push_back(col_name);
-		} else {
-			orig_names_fact.push_back(col_name_mappings[col_name]);
+RowVectorPtr Split::_next_batch() {
+	if (_loader != nullptr) {
+		return _loader->next();
+	}
+	if (_next_batch_no < _table.size()) {
+		return _table[_next_batch_no++];
+	}
+	return nullptr;
+}
+
+// SINGLE HASH-ENCODING PASS OVER THE INPUT FOR ALL THE COLUMN GROUPS
+void Split::_split(
+	vector<vector<int64_t>> &col_groups, vector<RowVectorPtr> &dim_tables,
+	map<string, string> &col_name_mappings,
+	std::function<void(RowVectorPtr&)> emit_fact_batch) {
+	// STEP 4: Split the table into star schema, one batch at a time
+	vector<DimDictionary> dims(col_groups.size());
+
+	// Fact table columns are the columns that are not in any group (in
+	// their original order), followed by the keys of the groups
+	vector<int64_t> fact_col_ids;
+	vector<string> orig_names_fact;
+	for (auto i = 0; i < col_name_mappings.size(); i++) {
+		bool in_group = false;
+		for (auto &col_group : col_groups) {
+			if (find(col_group.begin(), col_group.end(), i) != col_group.end()) {
+				in_group = true;
+			}
+		}
+		if (!in_group) {
+			fact_col_ids.push_back(i);
+			orig_names_fact.push_back(col_name_mappings[string("c") + to_string(i)]);
 		}
 	}
-	fact_table = makeRowVector(orig_names_fact, fact_table_local->children());
-	// cout << orig_names_fact.size() << " " << fact_table_local->children().size() << endl;
+	for (auto group_no = 0; group_no < col_groups.size(); group_no++) {
+		orig_names_fact.push_back(string("p") + to_string(group_no));
+	}
 
-	group_no = 0;
-	for (auto orig_names_dim : orig_names_dims) {
-		auto results = makeRowVector(orig_names_dim, dim_tables_local[group_no]->children());
-		dim_tables.push_back(results);
-		group_no += 1;
+	int64_t num_rows = 0;
+	while (auto batch = _next_batch()) {
+		auto fact_batch = _encode(batch, num_rows, col_groups, fact_col_ids, dims);
+		auto named_batch = makeRowVector(orig_names_fact, fact_batch->children());
+		emit_fact_batch(named_batch);
+		num_rows += batch->size();
 	}
 
-	// cout << fact_table->toString() << endl;
-	// cout << fact_table->toString(0, 10) << endl << endl;
+	for (auto group_no = 0; group_no < col_groups.size(); group_no++) {
+		vector<string> orig_names_dim;
+		for (auto col_no : col_groups[group_no]) {
+			orig_names_dim.push_back(col_name_mappings[string("c") + to_string(col_no)]);
+		}
+		dim_tables.push_back(_dim_table(dims[group_no], group_no, orig_names_dim));
+	}
 }
 
-void StoreVeloxToCSV::_store_single_row_vector(RowVectorPtr& velox_table, string filename) {
+void Split::compute(
+	vector<vector<int64_t>> &col_groups, vector<int64_t> &fact,
+	vector<RowVectorPtr> &dim_tables, vector<RowVectorPtr> &fact_table,
+	map<string, string> &col_name_mappings) {
+	// The fact table is kept as the batches produced by the encoder
+	_split(col_groups, dim_tables, col_name_mappings, [&](RowVectorPtr &fact_batch) {
+		fact_table.push_back(fact_batch);
+	});
+}
+
+void Split::compute(
+	vector<vector<int64_t>> &col_groups, vector<int64_t> &fact,
+	vector<RowVectorPtr> &dim_tables, StoreVeloxToCSV &store,
+	map<string, string> &col_name_mappings) {
+	// The fact table is stored as it is generated
+	_split(col_groups, dim_tables, col_name_mappings, [&](RowVectorPtr &fact_batch) {
+		store.append_fact(fact_batch);
+	});
+}
+
+shared_ptr<arrow::RecordBatch> StoreVeloxToCSV::_to_arrow(RowVectorPtr& velox_table) {
 	struct timespec startTime, endTime;
 	clock_gettime(CLOCK_MONOTONIC, &(startTime));
 
+	// The row vector is exported once, as a struct array, and imported as a
+	// record batch. The import takes ownership of (and releases) both the
+	// array and its schema.
 	ArrowSchema schema;
+	ArrowArray array;
 	exportToArrow(velox_table, schema);
-	auto arrow_schema = arrow::ImportSchema(&schema).ValueOrDie();
+	exportToArrow(velox_table, array, pool());
+	auto maybe_batch = arrow::ImportRecordBatch(&array, &schema);
+	if (!maybe_batch.ok()) {
+		cout << "ERROR converting table to Arrow: " << maybe_batch.status().ToString() << endl;
+		exit(3);
+	}
 
-	// For some reason this has to be done twice
-	exportToArrow(velox_table, schema);
-	vector<std::shared_ptr<arrow::Array>> arrow_arrays;
-	auto i = 0;
-	for (auto child : velox_table->children()) {
-		ArrowArray array;
-		exportToArrow(child, array, pool());
-		auto arr = arrow::ImportArray(&array, schema.children[i]).ValueOrDie();
-		// arrow_arrays.push_back(arrow::ImportArray(&array, _type).ValueOrDie());
-		arrow_arrays.push_back(arr);
-		i++;
+	clock_gettime(CLOCK_MONOTONIC, &(endTime));
+	auto timeDiff = getTimeDiff(startTime, endTime);
+	velox_to_arrow_time_ns += timeDiff;
+	return *maybe_batch;
+}
+
+shared_ptr<arrow::Table> StoreVeloxToCSV::_to_arrow_table(RowVectorPtr& velox_table) {
+	return arrow::Table::FromRecordBatches({_to_arrow(velox_table)}).ValueOrDie();
+}
+
+TableWriter::TableWriter(string filename, const shared_ptr<arrow::Schema> &schema) {
+	_filename = filename;
+	_schema = schema;
+	auto maybe_stream = arrow::io::FileOutputStream::Open(filename);
+	if (!maybe_stream.ok()) {
+		cout << "ERROR opening " << filename << " for writing" << endl;
+		exit(3);
 	}
+	_stream = *maybe_stream;
+
+	arrow::Status status;
+	if (FLAGS_format == "parquet") {
+		auto properties = parquet::WriterProperties::Builder().compression(outputCompression())->build();
+		status = parquet::arrow::FileWriter::Open(
+			*schema, arrow::default_memory_pool(), _stream, properties,
+			parquet::ArrowWriterProperties::Builder().build(), &_parquet_writer);
+	} else if (FLAGS_format == "ipc") {
+		auto options = arrow::ipc::IpcWriteOptions::Defaults();
+		if (outputCompression() != arrow::Compression::UNCOMPRESSED) {
+			auto maybe_codec = arrow::util::Codec::Create(outputCompression());
+			status = maybe_codec.status();
+			if (status.ok()) {
+				options.codec = std::move(*maybe_codec);
+			}
+		}
+		if (status.ok()) {
+			auto maybe_writer = arrow::ipc::MakeFileWriter(_stream, schema, options);
+			status = maybe_writer.status();
+			if (status.ok()) {
+				_writer = *maybe_writer;
+			}
+		}
+	} else if (outputCompression() != arrow::Compression::UNCOMPRESSED) {
+		// The CSV is compressed on its way to the file, closing the
+		// compressed stream also closes the file
+		auto maybe_codec = arrow::util::Codec::Create(outputCompression());
+		status = maybe_codec.status();
+		if (status.ok()) {
+			_codec = std::move(*maybe_codec);
+			auto maybe_compressed = arrow::io::CompressedOutputStream::Make(_codec.get(), _stream);
+			status = maybe_compressed.status();
+			if (status.ok()) {
+				_stream = *maybe_compressed;
+			}
+		}
+	}
+	if (!status.ok()) {
+		cout << "ERROR initializing writer for " << filename << ": " << status.ToString() << endl;
+		exit(3);
+	}
+}
 
-	auto arrow_table = arrow::Table::Make(arrow_schema, arrow_arrays);
+void TableWriter::write(const arrow::Table &table) {
+	arrow::Status status;
+	if (_parquet_writer != nullptr) {
+		// Row groups of up to 1M rows, every piece written starts a new one
+		const int64_t row_group_rows = 1 << 20;
+		status = _parquet_writer->WriteTable(table, row_group_rows);
+	} else if (_writer != nullptr) {
+		status = _writer->WriteTable(table);
+	} else {
+		// CSV: the header is written with the first piece
+		if (!_header_written) {
+			string header;
+			for (const auto& field : _schema->fields()) {
+				header += (header.empty() ? "" : ",") + _csv_field(field->name());
+			}
+			header += "\n";
+			status = _stream->Write(header.data(), header.size());
+			_header_written = true;
+		}
+
+		// Arrow encodes CSV on a single thread, so the piece is cut into
+		// slices that are encoded in parallel on Arrow's CPU pool, a round
+		// of arrowThreads() slices at a time, and written in order.
+		const int64_t slice_rows = 1 << 16;
+		int64_t num_slices = (table.num_rows() + slice_rows - 1) / slice_rows;
+		int64_t slices_per_round = arrowThreads();
+		for (int64_t first = 0; first < num_slices && status.ok(); first += slices_per_round) {
+			auto n = std::min(slices_per_round, num_slices - first);
+			vector<shared_ptr<arrow::Buffer>> encoded(n);
+			status = arrow::internal::OptionalParallelFor(n > 1, n, [&](int i) {
+				auto slice = table.Slice((first + i) * slice_rows, slice_rows);
+				ARROW_ASSIGN_OR_RAISE(encoded[i], _encode_csv(*slice));
+				return arrow::Status::OK();
+			});
+			for (auto i = 0; i < n && status.ok(); i++) {
+				status = _stream->Write(encoded[i]);
+			}
+		}
+	}
+	if (!status.ok()) {
+		cout << "ERROR writing " << _filename << ": " << status.ToString() << endl;
+		exit(3);
+	}
+}
+
+void TableWriter::close() {
+	arrow::Status status;
+	if (_parquet_writer != nullptr) {
+		status = _parquet_writer->Close();
+	} else if (_writer != nullptr) {
+		status = _writer->Close();
+	}
+	if (status.ok()) {
+		status = _stream->Close();
+	}
+	if (!status.ok()) {
+		cout << "ERROR closing " << _filename << ": " << status.ToString() << endl;
+		exit(3);
+	}
+}
+
+// Converts a column read as strings to type, missing (empty) values become nulls
+arrow::Result<arrow::Datum> _cast_column(
+	const shared_ptr<arrow::ChunkedArray> &column, const shared_ptr<arrow::DataType> &type) {
+	arrow::Datum values(column);
+	if (column->type()->id() == arrow::Type::STRING) {
+		ARROW_ASSIGN_OR_RAISE(auto empty, arrow::compute::CallFunction("equal",
+			{values, arrow::Datum(std::make_shared<arrow::StringScalar>(""))}));
+		ARROW_ASSIGN_OR_RAISE(values, arrow::compute::CallFunction("if_else",
+			{empty, arrow::Datum(arrow::MakeNullScalar(arrow::utf8())), values}));
+	}
+	return arrow::compute::Cast(values, type);
+}
+
+shared_ptr<arrow::Table> StoreVeloxToCSV::_with_output_types(
+	const shared_ptr<arrow::Table> &table, bool typed) {
+	// CSV is text, the columns are written as they are
+	if (FLAGS_format == "csv") {
+		return table;
+	}
+
+	vector<shared_ptr<arrow::Field>> fields;
+	vector<shared_ptr<arrow::ChunkedArray>> columns;
+	for (auto i = 0; i < table->num_columns(); i++) {
+		auto field = table->schema()->field(i);
+		auto column = table->column(i);
+
+		shared_ptr<arrow::DataType> type;
+		auto key_type = _key_types.find(field->name());
+		if (key_type != _key_types.end()) {
+			type = key_type->second;
+		} else if (typed && column_types != nullptr) {
+			auto inferred = column_types->GetFieldByName(field->name());
+			if (inferred != nullptr && inferred->type()->id() != arrow::Type::STRING &&
+				inferred->type()->id() != arrow::Type::NA) {
+				type = inferred->type();
+			}
+		}
+
+		if (type != nullptr) {
+			// The types were inferred on a prefix of the file, keep the
+			// column as it is if some value does not convert
+			auto cast = _cast_column(column, type);
+			if (cast.ok()) {
+				column = (*cast).chunked_array();
+				field = field->WithType(type);
+			} else {
+				cout << "WARNING: column " << field->name() << " kept as string, it does not convert to " <<
+					type->ToString() << ": " << cast.status().ToString() << endl;
+			}
+		}
+		fields.push_back(field);
+		columns.push_back(column);
+	}
+	return arrow::Table::Make(arrow::schema(fields), columns);
+}
+
+void StoreVeloxToCSV::_write_table(const shared_ptr<arrow::Table> &arrow_table, string name) {
+	struct timespec startTime, endTime;
+	clock_gettime(CLOCK_MONOTONIC, &(startTime));
+
+	TableWriter writer(outputPath(name), arrow_table->schema());
+	writer.write(*arrow_table);
+	writer.close();
+	_add_rows(name, *arrow_table);
 
 	clock_gettime(CLOCK_MONOTONIC, &(endTime));
 	auto timeDiff = getTimeDiff(startTime, endTime);
-	velox_to_arrow_time_ns += timeDiff;
+	arrow_to_csv_time_ns += timeDiff;
+}
+
+void StoreVeloxToCSV::_write_tables(const vector<pair<string, shared_ptr<arrow::Table>>> &tables) {
+	if (tables.size() <= 1 || veloxThreads() == 1) {
+		for (const auto& table : tables) {
+			_write_table(_with_output_types(table.second, true), table.first);
+		}
+		return;
+	}
+
+	vector<folly::Future<folly::Unit>> writes;
+	for (const auto& table : tables) {
+		writes.push_back(folly::via(_executor.get(), [this, &table]() {
+			_write_table(_with_output_types(table.second, true), table.first);
+		}));
+	}
+	for (auto& result : folly::collectAll(writes).get()) {
+		// value() rethrows the exception of a failed write
+		result.value();
+	}
+}
+
+void StoreVeloxToCSV::_add_rows(string name, const arrow::Table &arrow_table) {
+	std::lock_guard<std::mutex> lock(_tables_mutex);
+	auto& info = _tables[name];
+	info.schema = arrow_table.schema();
+	info.num_rows += arrow_table.num_rows();
+}
+
+folly::dynamic _columns_json(const arrow::Schema &schema, int num_columns) {
+	auto columns = folly::dynamic::array();
+	for (auto i = 0; i < num_columns; i++) {
+		columns.push_back(folly::dynamic::object
+			("name", schema.field(i)->name())
+			("type", schema.field(i)->type()->ToString()));
+	}
+	return columns;
+}
+
+folly::dynamic StoreVeloxToCSV::table_stats() {
+	folly::dynamic tables = folly::dynamic::object;
+	for (const auto& [name, info] : _tables) {
+		std::error_code error;
+		auto bytes = std::filesystem::file_size(outputPath(name), error);
+		tables[name] = folly::dynamic::object
+			("file", outputPath(name))
+			("num_rows", info.num_rows)
+			("bytes", error ? 0 : int64_t(bytes));
+	}
+	return tables;
+}
+
+void StoreVeloxToCSV::store_schema() {
+	auto file_name = [](string name) {
+		return std::filesystem::path(outputPath(name)).filename().string();
+	};
+
+	// The dimension tables end with their key column p<N>, which is also a
+	// column of the fact table
+	auto dims = folly::dynamic::array();
+	for (auto i = 0; _tables.count(string("dim") + to_string(i)) > 0; i++) {
+		auto name = string("dim") + to_string(i);
+		const auto& info = _tables[name];
+		auto key = info.schema->field(info.schema->num_fields() - 1);
+		dims.push_back(folly::dynamic::object
+			("name", name)
+			("file", file_name(name))
+			("key", key->name())
+			("key_type", key->type()->ToString())
+			// Every row of a dimension table is a distinct combination of values
+			("cardinality", info.num_rows)
+			("num_rows", info.num_rows)
+			("columns", _columns_json(*info.schema, info.schema->num_fields() - 1)));
+	}
+
+	const auto& fact = _tables["fact"];
+	auto keys = folly::dynamic::array();
+	for (const auto& dim : dims) {
+		keys.push_back(dim["key"]);
+	}
+	folly::dynamic schema = folly::dynamic::object
+		("version", splitCsvVersion)
+		("format", FLAGS_format)
+		("compression", FLAGS_compression)
+		// The columns of the CSV file in their original order, with the types
+		// Arrow inferred for them
+		("columns", _columns_json(*column_types, column_types->num_fields()))
+		("fact", folly::dynamic::object
+			("name", "fact")
+			("file", file_name("fact"))
+			("num_rows", fact.num_rows)
+			("keys", keys)
+			("columns", _columns_json(*fact.schema, fact.schema->num_fields())))
+		("dimensions", dims);
+
+	auto path = std::filesystem::path(FLAGS_output_dir) / (FLAGS_output_prefix + "schema.json");
+	std::ofstream out(path);
+	out << folly::toPrettyJson(schema) << endl;
+	if (!out) {
+		cout << "ERROR writing " << path.string() << endl;
+		exit(3);
+	}
+}
+
+void StoreVeloxToCSV::_store_single_row_vector(RowVectorPtr& velox_table, string name) {
+	_write_table(_with_output_types(_to_arrow_table(velox_table), true), name);
+}
+
+void StoreVeloxToCSV::append_fact(RowVectorPtr &fact_batch) {
+	// The types of the fact columns must not change from one batch to the
+	// next, so the columns are not converted to the inferred types here.
+	// _key_types is empty too: the largest key of a dimension is only known
+	// once the whole file is split, and the estimated cardinalities may be
+	// too low, so the keys stay int64 (--dense_keys does not narrow them).
+	auto arrow_table = _with_output_types(_to_arrow_table(fact_batch), false);
+
+	struct timespec startTime, endTime;
 	clock_gettime(CLOCK_MONOTONIC, &(startTime));
 
-	auto outstream = arrow::io::FileOutputStream::Open(filename).ValueOrDie();
-	arrow::csv::WriteCSV(*arrow_table, arrow::csv::WriteOptions::Defaults(), outstream.get());
+	if (_fact_writer == nullptr) {
+		_fact_writer = std::make_unique<TableWriter>(outputPath("fact"), arrow_table->schema());
+	}
+	_fact_writer->write(*arrow_table);
+	_add_rows("fact", *arrow_table);
 
 	clock_gettime(CLOCK_MONOTONIC, &(endTime));
-	timeDiff = getTimeDiff(startTime, endTime);
+	auto timeDiff = getTimeDiff(startTime, endTime);
 	arrow_to_csv_time_ns += timeDiff;
 }
 
-void StoreVeloxToCSV::store(vector<RowVectorPtr> &dim_tables, RowVectorPtr &fact_table) {
-	// Store fact table
-	_store_single_row_vector(fact_table, "fact.csv");
+void StoreVeloxToCSV::store_dims(vector<RowVectorPtr> &dim_tables) {
+	// Finish the fact table if it was written batch by batch
+	if (_fact_writer != nullptr) {
+		_fact_writer->close();
+		_fact_writer = nullptr;
+	}
+	vector<pair<string, shared_ptr<arrow::Table>>> tables;
+	_add_dims(dim_tables, tables);
+	_write_tables(tables);
+}
+
+void StoreVeloxToCSV::_add_dims(
+	vector<RowVectorPtr> &dim_tables, vector<pair<string, shared_ptr<arrow::Table>>> &tables) {
+	// The export to Arrow stays on this thread, it allocates from the
+	// memory pool of the store
 	auto i = 0;
 	for (auto table : dim_tables) {
-		_store_single_row_vector(table, string("dim")+to_string(i)+string(".csv"));
+		tables.push_back({string("dim") + to_string(i), _to_arrow_table(table)});
 		i++;
 	}
-	// cout << "Time to port velox to arrow: " << velox_to_arrow_time_ns << " ns" << endl;
-	// cout << "Time to store to CSV: " << arrow_to_csv_time_ns << " ns" << endl;
+}
+
+void StoreVeloxToCSV::store(vector<RowVectorPtr> &dim_tables, vector<RowVectorPtr> &fact_table) {
+	// The whole split is known, so the keys can be stored in the narrowest
+	// type that holds the largest key of their dimension
+	auto i = 0;
+	for (auto table : dim_tables) {
+		auto keys = table->childAt(table->childrenSize() - 1)->asFlatVector<int64_t>();
+		int64_t max_key = 0;
+		for (auto row = 0; row < keys->size(); row++) {
+			max_key = std::max(max_key, keys->valueAt(row));
+		}
+		shared_ptr<arrow::DataType> key_type = arrow::int64();
+		if (max_key <= std::numeric_limits<uint8_t>::max()) {
+			key_type = arrow::uint8();
+		} else if (max_key <= std::numeric_limits<uint16_t>::max()) {
+			key_type = arrow::uint16();
+		} else if (max_key <= std::numeric_limits<uint32_t>::max()) {
+			key_type = arrow::uint32();
+		}
+		_key_types[string("p") + to_string(i)] = key_type;
+		i++;
+	}
+
+	// Store the fact table and the dimension tables concurrently
+	vector<shared_ptr<arrow::RecordBatch>> fact_batches;
+	for (auto fact_batch : fact_table) {
+		fact_batches.push_back(_to_arrow(fact_batch));
+	}
+	vector<pair<string, shared_ptr<arrow::Table>>> tables;
+	tables.push_back({"fact", arrow::Table::FromRecordBatches(fact_batches).ValueOrDie()});
+	_add_dims(dim_tables, tables);
+	_write_tables(tables);
 }
 
 int main(int argc, char** argv) {
+	// Parse (and strip) the command line flags before looking at the file name
+	gflags::SetVersionString(splitCsvVersion);
+	folly::init(&argc, &argv);
 	if (argc != 2) {
 		// cout << "Please include data file name in argument" << endl;
 		exit(1);
 	}
-	folly::init(&argc, &argv, false);
+	if (FLAGS_format != "csv" && FLAGS_format != "parquet" && FLAGS_format != "ipc") {
+		cout << "ERROR: unknown output format " << FLAGS_format << endl;
+		exit(1);
+	}
+	if (FLAGS_quoting != "needed" && FLAGS_quoting != "all") {
+		cout << "ERROR: unknown quoting " << FLAGS_quoting << endl;
+		exit(1);
+	}
+	if (FLAGS_compression != "none" && FLAGS_compression != "gzip" &&
+		FLAGS_compression != "zstd" && FLAGS_compression != "lz4") {
+		cout << "ERROR: unknown compression " << FLAGS_compression << endl;
+		exit(1);
+	}
+	if (FLAGS_format == "ipc" && FLAGS_compression == "gzip") {
+		cout << "ERROR: Arrow IPC files cannot be compressed with gzip" << endl;
+		exit(1);
+	}
+	std::error_code error;
+	std::filesystem::create_directories(FLAGS_output_dir, error);
+	if (error) {
+		cout << "ERROR creating output directory " << FLAGS_output_dir << ": " << error.message() << endl;
+		exit(1);
+	}
+	if (!arrow::SetCpuThreadPoolCapacity(arrowThreads()).ok()) {
+		cout << "ERROR setting the number of Arrow threads" << endl;
+		exit(1);
+	}
 
 	// Load the CSV file into Velox via Arrow
 	LoadCSVtoVelox loader;
 	string path_to_file(argv[1]);
 	std::map<string, string> col_name_mappings;
-	struct timespec startTime, endTime;
-	auto table = loader.load(path_to_file, col_name_mappings);
+	folly::dynamic phases = folly::dynamic::object;
+	vector<vector<int64_t>> col_groups;
+	vector<int64_t> fact_cols;
+	vector<RowVectorPtr> dim_tables;
 
-	clock_gettime(CLOCK_MONOTONIC, &(startTime));
+	// Called when the run is over, with the parts that were used
+	auto finish = [&](CreateColumnGroupings* groups, Split* split, StoreVeloxToCSV* store) {
+		if (FLAGS_stats_json.empty()) {
+			return;
+		}
+		auto cardinalities = folly::dynamic::array();
+		for (auto i = 0; i < col_groups.size(); i++) {
+			auto columns = folly::dynamic::array();
+			for (auto col_id : col_groups[i]) {
+				columns.push_back(col_name_mappings[string("c") + to_string(col_id)]);
+			}
+			cardinalities.push_back(folly::dynamic::object
+				("dimension", string("dim") + to_string(i))
+				("columns", columns)
+				("cardinality", i < dim_tables.size() ? int64_t(dim_tables[i]->size()) : 0));
+		}
 
-	// Compute column groupings for splitting
+		// The Velox memory pools of each part (queries run in their own
+		// pools), Arrow's memory pool, and the resident set of the process
+		folly::dynamic peak_memory = folly::dynamic::object
+			("load", loader.peak_memory_bytes())
+			("arrow", arrow::default_memory_pool()->max_memory());
+		if (groups != nullptr) {
+			peak_memory["statistics"] = groups->peak_memory_bytes();
+		}
+		if (split != nullptr) {
+			peak_memory["split"] = split->peak_memory_bytes();
+		}
+		if (store != nullptr) {
+			peak_memory["store"] = store->peak_memory_bytes();
+		}
+		struct rusage usage;
+		getrusage(RUSAGE_SELF, &usage);
+		peak_memory["max_rss"] = int64_t(usage.ru_maxrss) * 1024;
+
+		// Parts of the phases above, summed over batches (and threads)
+		phases["read_csv"] = folly::dynamic::object("wall_ns", int64_t(loader.csv_to_arrow_time_ns));
+		phases["arrow_to_velox"] = folly::dynamic::object("wall_ns", int64_t(loader.arrow_to_velox_time_ns));
+		if (store != nullptr) {
+			phases["velox_to_arrow"] = folly::dynamic::object("wall_ns", int64_t(store->velox_to_arrow_time_ns.load()));
+			phases["write"] = folly::dynamic::object("wall_ns", int64_t(store->arrow_to_csv_time_ns.load()));
+		}
+
+		std::error_code error;
+		auto bytes_in = std::filesystem::file_size(path_to_file, error);
+		folly::dynamic tables = folly::dynamic::object;
+		if (store != nullptr) {
+			tables = store->table_stats();
+		}
+		int64_t bytes_out = 0;
+		for (const auto& table : tables.values()) {
+			bytes_out += table["bytes"].asInt();
+		}
+		folly::dynamic stats = folly::dynamic::object
+			("version", splitCsvVersion)
+			("input", path_to_file)
+			("split", store != nullptr)
+			("num_threads", numThreads())
+			("num_rows", loader.num_rows)
+			("num_columns", int64_t(col_name_mappings.size()))
+			("bytes_in", error ? 0 : int64_t(bytes_in))
+			("bytes_out", bytes_out)
+			("phases", phases)
+			("peak_memory_bytes", peak_memory)
+			("column_groups", cardinalities)
+			("tables", tables);
+
+		std::ofstream out(FLAGS_stats_json);
+		out << folly::toPrettyJson(stats) << endl;
+		if (!out) {
+			cout << "ERROR writing " << FLAGS_stats_json << endl;
+			exit(3);
+		}
+	};
+
+	if (FLAGS_streaming) {
+		// Statistics pass, unless the grouping is known
+		PhaseTime statistics_time;
+		loader.open(path_to_file, col_name_mappings);
+		CreateColumnGroupings groups(&loader);
+		if (FLAGS_grouping_from.empty()) {
+			groups.compute(col_groups, fact_cols);
+		} else {
+			groups.load(FLAGS_grouping_from, col_name_mappings, col_groups, fact_cols);
+		}
+		groups.save(col_name_mappings, col_groups, fact_cols);
+		phases["statistics"] = statistics_time.stop();
+		if (col_groups.size() == 0) {
+			cout << "TABLE NOT SPLIT, RETAIN ORIGINAL CSV" << endl;
+			finish(&groups, nullptr, nullptr);
+			return 0;
+		}
+
+		// Split pass, the fact table is stored as it is generated
+		PhaseTime split_time;
+		if (FLAGS_grouping_from.empty()) {
+			loader.open(path_to_file, col_name_mappings);
+		}
+		StoreVeloxToCSV store;
+		store.column_types = loader.inferred_schema();
+		Split split(&loader);
+		split.compute(col_groups, fact_cols, dim_tables, store, col_name_mappings);
+		phases["split"] = split_time.stop();
+		// With --grouping_from, this is the first pass that reads the rows
+		if (loader.num_rows == 0) {
+			cout << "ERROR: no rows in CSV file" << endl;
+			exit(2);
+		}
+		PhaseTime store_time;
+		store.store_dims(dim_tables);
+		store.store_schema();
+		phases["store"] = store_time.stop();
+		finish(&groups, &split, &store);
+		return 0;
+	}
+
+	PhaseTime load_time;
+	auto table = loader.load(path_to_file, col_name_mappings);
+	if (table.empty()) {
+		cout << "ERROR: no rows in CSV file" << endl;
+		exit(2);
+	}
+	phases["load"] = load_time.stop();
+
+	// Compute column groupings for splitting, or reuse known ones
+	PhaseTime statistics_time;
 	CreateColumnGroupings groups(table);
-	vector<vector<int64_t>> col_groups;
-	vector<int64_t> fact_cols;
-	groups.compute(col_groups, fact_cols);
+	if (FLAGS_grouping_from.empty()) {
+		groups.compute(col_groups, fact_cols);
+	} else {
+		groups.load(FLAGS_grouping_from, col_name_mappings, col_groups, fact_cols);
+	}
+	groups.save(col_name_mappings, col_groups, fact_cols);
+	phases["statistics"] = statistics_time.stop();
 	if (col_groups.size() == 0) {
 		cout << "TABLE NOT SPLIT, RETAIN ORIGINAL CSV" << endl;
+		finish(&groups, nullptr, nullptr);
 		return 0;
 	}
 
 	// Split the table into star schema
+	PhaseTime split_time;
 	Split split(table);
-	vector<RowVectorPtr> dim_tables;
-	RowVectorPtr fact_table;
+	vector<RowVectorPtr> fact_table;
 	split.compute(col_groups, fact_cols, dim_tables, fact_table, col_name_mappings);
+	phases["split"] = split_time.stop();
 
-	clock_gettime(CLOCK_MONOTONIC, &(endTime));
-	auto timeDiff = getTimeDiff(startTime, endTime);
-	// cout << "Time for splitting: " << timeDiff << " ns" << endl;
-
-	// Convert back to arrow and store as CSV
-	StoreVeloxToCSV().store(dim_tables, fact_table);
+	// Convert back to arrow and store as CSV (or --format)
+	PhaseTime store_time;
+	StoreVeloxToCSV store;
+	store.column_types = loader.inferred_schema();
+	store.store(dim_tables, fact_table);
+	store.store_schema();
+	phases["store"] = store_time.stop();
+	finish(&groups, &split, &store);
 
 	return 0;
-}
\ No newline at end of file
+}